@@ -0,0 +1,440 @@
+import os
+import sys
+import json
+import math
+import time
+import random
+import shutil
+import asyncio
+import argparse
+import platform
+import resource
+import tempfile
+import threading
+import subprocess
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from datetime import datetime, timezone
+from typing import Dict, Any, List, Optional, Tuple
+
+# Benchmarks for the document worker and the chat API.
+#
+# The worker benchmark fills a local queue with a synthetic mix of asset types
+# and document sizes. It runs main_loop against local fakes for Supabase,
+# OpenAI, document downloads and output storage, each with configurable
+# latency and error rates. Every worker mode runs in a fresh subprocess, so
+# caches, module state and peak memory do not leak between runs. The chat
+# benchmark load-tests chat_api.app in-process.
+#
+# Results are printed, or written with --output, as JSON for tracking over time:
+#
+#     python benchmark.py worker --modes sequential,concurrent,pipeline --assets 200
+#     python benchmark.py chat --requests 2000 --concurrency 50
+#     python benchmark.py classifier --message-chars 100,1000,10000
+
+ASSET_TYPES = ["e-learning", "video", "process-map", "job-aid"]
+
+# Top-level sections per synthetic document size
+DOCUMENT_SIZES = {"small": 4, "medium": 20, "large": 100}
+
+CHAT_MESSAGES = [
+    "What is TOME?",
+    "How much does it cost?",
+    "How does it work?",
+    "Can I update a course after it is delivered?",
+    "Can you show me some examples of your e-learning work?",
+    "Do you have a sample video?",
+    "Why is TOME better than hiring a contractor?",
+    "What is on your roadmap?",
+    "How do I sign up for a trial?",
+    "Do you support SCORM packages for our LMS?"
+]
+
+def percentile(values: List[float], percent: float) -> float:
+    """Nearest-rank percentile of a list of values."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(1, math.ceil(percent / 100 * len(ordered)))
+    return ordered[rank - 1]
+
+def summarize(values: List[float]) -> Dict[str, float]:
+    return {
+        "count": len(values),
+        "mean": sum(values) / len(values) if values else 0.0,
+        "p50": percentile(values, 50),
+        "p95": percentile(values, 95),
+        "p99": percentile(values, 99)
+    }
+
+def peak_memory_mb() -> float:
+    # ru_maxrss is reported in kilobytes on Linux and in bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+def synthetic_document(sections: int, rng: random.Random) -> str:
+    """Generate an SOP with numbered sections, sub-steps and bullet points."""
+    lines = [f"Standard Operating Procedure: Synthetic Process {rng.randint(1000, 9999)}", ""]
+    for number in range(1, sections + 1):
+        lines.append(f"{number}. Section {number}")
+        lines.append(f"This section describes part {number} of the procedure in detail.")
+        for step in range(1, rng.randint(1, 4) + 1):
+            lines.append(f"{number}.{step} Step {number}.{step}")
+            lines.extend(f"- Action {item} for step {number}.{step}" for item in range(1, rng.randint(2, 5) + 1))
+        lines.append("")
+    return "\n".join(lines)
+
+class DocumentServer:
+    """Serves synthetic documents over HTTP, after `latency` seconds per request."""
+
+    def __init__(self, documents: Dict[str, bytes], latency: float = 0.0):
+        server = self
+        self.documents = documents
+        self.latency = latency
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                pass
+
+            def do_GET(self):
+                time.sleep(server.latency)
+                body = server.documents.get(self.path.lstrip("/"))
+                if body is None:
+                    self.send_error(404)
+                    return
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, name="document-server", daemon=True).start()
+
+    def url(self, name: str) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/{name}"
+
+def build_queue(args: argparse.Namespace, rng: random.Random) -> Dict[str, Any]:
+    """Synthetic documents and the assets ordered from them, spread over several tenants."""
+    sizes = [size.strip() for size in args.sizes.split(",")]
+    documents = {
+        f"doc-{index}.txt": synthetic_document(DOCUMENT_SIZES[rng.choice(sizes)], rng).encode("utf-8")
+        for index in range(args.documents)
+    }
+
+    assets = []
+    names = sorted(documents)
+    while len(assets) < args.assets:
+        name = rng.choice(names)
+        # Customers usually order several formats of the same document at once
+        for asset_type in rng.sample(ASSET_TYPES, rng.randint(1, len(ASSET_TYPES))):
+            assets.append({"document": name, "asset_type": asset_type, "organization_id": f"org-{rng.randrange(args.tenants)}"})
+    return {"documents": documents, "assets": assets[:args.assets]}
+
+def run_worker(args: argparse.Namespace, workdir: str) -> Dict[str, Any]:
+    """Run one worker mode over a synthetic queue and measure it. Runs in its own process."""
+    rng = random.Random(args.seed)
+    random.seed(args.seed)
+
+    # The worker reads its configuration at import time
+    os.environ.update({
+        "SIMULATE_PROCESSING": "false",
+        "SIMULATED_WORK_SCALE": str(args.work_scale),
+        "WORKER_MODE": args.mode,
+        "WORKER_ID": f"benchmark-{args.mode}",
+        "OPENAI_API_KEY": "benchmark",
+        "OPENAI_REQUESTS_PER_MINUTE": str(args.openai_rpm),
+        "OPENAI_RATE_LIMIT_STATE": os.path.join(workdir, "openai-limiter.json"),
+        "OUTPUT_STORAGE": f"local:{os.path.join(workdir, 'outputs')}",
+        "EXTRACTION_CACHE_DIR": os.path.join(workdir, "extraction-cache"),
+        "COMPLETION_CACHE_DIR": os.path.join(workdir, "completion-cache"),
+        "SECTION_INDEX_DIR": os.path.join(workdir, "section-index"),
+        "CHECKPOINT_DIR": os.path.join(workdir, "checkpoints"),
+        "UPLOAD_JOURNAL_DIR": os.path.join(workdir, "upload-journal"),
+        "ASSET_RETRY_BASE_SECONDS": str(args.retry_seconds),
+        "WORKER_IDLE_MAX_SECONDS": "1",
+        "WORKER_ERROR_MAX_SECONDS": "1"
+    })
+    os.environ.pop("DATABASE_URL", None)
+
+    import openai
+    import document_processor
+    from local_backends import LocalSupabaseClient, LocalOpenAIServer, LocalDirectoryStorage
+
+    openai_server = LocalOpenAIServer(latency=args.openai_latency, error_rate=args.openai_error_rate).start()
+    openai.base_url = openai_server.base_url
+    database = LocalSupabaseClient(latency=args.db_latency, error_rate=args.db_error_rate)
+    storage = LocalDirectoryStorage(os.path.join(workdir, "outputs"), latency=args.storage_latency,
+                                    error_rate=args.storage_error_rate)
+    document_processor.supabase = database
+    document_processor.output_uploader.storage = storage
+    document_processor.metrics.keep_samples()
+
+    queue = build_queue(args, rng)
+    documents = DocumentServer(queue["documents"], latency=args.download_latency)
+    started_at = time.time()
+    database.table("assets").insert([
+        {
+            "id": f"asset-{index}",
+            "asset_type": asset["asset_type"],
+            "organization_id": asset["organization_id"],
+            "user_id": "benchmark",
+            "original_document_url": documents.url(asset["document"]),
+            "original_document_name": asset["document"],
+            "status": "processing",
+            "attempts": 0,
+            "created_at": document_processor.utc_timestamp()
+        }
+        for index, asset in enumerate(queue["assets"])
+    ]).execute()
+
+    def finished() -> Dict[str, float]:
+        outcomes: Dict[str, float] = {}
+        for (name, labels), value in list(document_processor.metrics.counters.items()):
+            if name == "tome_assets_processed_total":
+                outcome = dict(labels)["outcome"]
+                outcomes[outcome] = outcomes.get(outcome, 0) + value
+        return outcomes
+
+    threading.Thread(target=document_processor.main_loop, args=(args.mode,), name="worker", daemon=True).start()
+    while True:
+        outcomes = finished()
+        done = outcomes.get("completed", 0) + outcomes.get("failed", 0)
+        if done >= len(queue["assets"]) or time.time() - started_at > args.timeout:
+            break
+        time.sleep(0.05)
+    elapsed = time.time() - started_at
+    document_processor.status_sink.flush()
+
+    stages: Dict[str, Dict[str, Any]] = {}
+    all_stages: Dict[str, List[float]] = {}
+    for (stage, asset_type), values in sorted((document_processor.metrics.samples or {}).items()):
+        stages.setdefault(stage, {})[asset_type] = summarize(values)
+        all_stages.setdefault(stage, []).extend(values)
+    for stage, values in all_stages.items():
+        stages[stage]["all"] = summarize(values)
+
+    rows = database.table("assets").select("status").execute().data
+    return {
+        "mode": args.mode,
+        "assets": len(queue["assets"]),
+        "documents": len(queue["documents"]),
+        "completed": outcomes.get("completed", 0),
+        "failed": outcomes.get("failed", 0),
+        "retried": outcomes.get("retried", 0),
+        "timed_out": done < len(queue["assets"]),
+        "rows_completed": sum(1 for row in rows if row["status"] == "completed"),
+        "elapsed_seconds": elapsed,
+        "assets_per_minute": done / elapsed * 60 if elapsed else 0.0,
+        "stage_latency_seconds": stages,
+        "peak_memory_mb": peak_memory_mb(),
+        "requests": {
+            "openai": openai_server.requests,
+            "openai_rate_limited": openai_server.rate_limited,
+            "database": sum(table.request_count for table in database.tables.values()) + database.rpc_count,
+            "storage": storage.requests
+        }
+    }
+
+async def load_test_chat(args: argparse.Namespace) -> Dict[str, Any]:
+    """Send `requests` chat requests with up to `concurrency` in flight and measure their latency.
+    
+    With --stream the requests go to /chat/stream, and time to first byte is measured as well.
+    """
+    # Only the chat benchmark needs the API and its test client
+    import httpx
+    from chat_api import app
+
+    rng = random.Random(args.seed)
+    payloads = [{"messages": [{"role": "user", "content": rng.choice(CHAT_MESSAGES)}]} for _ in range(args.requests)]
+    latencies: List[float] = []
+    first_byte_latencies: List[float] = []
+    errors = 0
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://benchmark") as client:
+        async def send(payload: Dict[str, Any]) -> None:
+            nonlocal errors
+            async with semaphore:
+                request_started_at = time.perf_counter()
+                if args.stream:
+                    first_byte_at = None
+                    async with client.stream("POST", "/chat/stream", json=payload) as response:
+                        async for _ in response.aiter_bytes():
+                            first_byte_at = first_byte_at or time.perf_counter()
+                    first_byte_latencies.append((first_byte_at or time.perf_counter()) - request_started_at)
+                else:
+                    response = await client.post("/chat", json=payload)
+                latencies.append(time.perf_counter() - request_started_at)
+                if response.status_code != 200:
+                    errors += 1
+
+        started_at = time.perf_counter()
+        await asyncio.gather(*(send(payload) for payload in payloads))
+        elapsed = time.perf_counter() - started_at
+
+    return {
+        "endpoint": "/chat/stream" if args.stream else "/chat",
+        "requests": args.requests,
+        "concurrency": args.concurrency,
+        "errors": errors,
+        "elapsed_seconds": elapsed,
+        "requests_per_second": args.requests / elapsed if elapsed else 0.0,
+        "latency_seconds": summarize(latencies),
+        "first_byte_seconds": summarize(first_byte_latencies) if args.stream else None,
+        "peak_memory_mb": peak_memory_mb()
+    }
+
+def sequential_classify(message: str) -> Tuple[str, bool, Optional[str]]:
+    """Reference classifier: one substring scan per keyword list, as chat_api did before it was compiled."""
+    from chat_api import INTENT_KEYWORDS, SAMPLE_REQUEST_KEYWORDS, SAMPLE_TYPE_KEYWORDS
+
+    intent = next((name for name, keywords in INTENT_KEYWORDS
+                   if any(keyword in message.lower() for keyword in keywords)), "default")
+    wants_samples = any(keyword in message.lower() for keyword in SAMPLE_REQUEST_KEYWORDS)
+    sample_type = next((name for name, keywords in SAMPLE_TYPE_KEYWORDS
+                        if any(keyword in message.lower() for keyword in keywords)), None)
+    return intent, wants_samples, sample_type
+
+def random_message(chars: int, rng: random.Random) -> str:
+    """Chat-like text of roughly `chars` characters, with keywords sprinkled in sparingly."""
+    from chat_api import INTENT_KEYWORDS, SAMPLE_TYPE_KEYWORDS
+
+    keywords = [keyword for _, group in INTENT_KEYWORDS + SAMPLE_TYPE_KEYWORDS for keyword in group]
+    filler = "we are looking at options for our training team and would like to know more about it".split()
+    words: List[str] = []
+    length = 0
+    while length < chars:
+        word = rng.choice(keywords).upper() if rng.random() < 0.01 else rng.choice(filler)
+        words.append(word)
+        length += len(word) + 1
+    return " ".join(words)
+
+def classifier_command(args: argparse.Namespace) -> Dict[str, Any]:
+    """Compare the compiled classifier with sequential keyword scans on messages of increasing length."""
+    from chat_api import classify_message
+
+    rng = random.Random(args.seed)
+    runs = []
+    for chars in [int(size) for size in args.message_chars.split(",")]:
+        messages = [random_message(chars, rng) for _ in range(args.messages)]
+        mismatches = sum(1 for message in messages if tuple(classify_message(message)) != sequential_classify(message))
+
+        timings = {}
+        for name, classify in (("compiled", classify_message), ("sequential", sequential_classify)):
+            started_at = time.perf_counter()
+            for _ in range(args.rounds):
+                for message in messages:
+                    classify(message)
+            timings[name] = time.perf_counter() - started_at
+
+        classified = args.messages * args.rounds
+        runs.append({
+            "message_chars": chars,
+            "messages": classified,
+            "mismatches": mismatches,
+            "compiled_messages_per_second": classified / timings["compiled"],
+            "sequential_messages_per_second": classified / timings["sequential"],
+            "speedup": timings["sequential"] / timings["compiled"]
+        })
+    return {"benchmark": "classifier", "runs": runs}
+
+def worker_command(args: argparse.Namespace) -> Dict[str, Any]:
+    """Benchmark each requested worker mode in its own subprocess."""
+    runs = []
+    for mode in [mode.strip() for mode in args.modes.split(",")]:
+        print(f"Benchmarking {mode} worker with {args.assets} assets...", file=sys.stderr)
+        with tempfile.NamedTemporaryFile(suffix=".json", delete=False) as result_file:
+            result_path = result_file.name
+
+        command = [sys.executable, os.path.abspath(__file__), "--seed", str(args.seed),
+                   "worker-run", "--mode", mode, "--result-file", result_path]
+        for name, value in vars(args).items():
+            if name not in ("command", "modes", "seed", "output", "verbose", "handler"):
+                command += [f"--{name.replace('_', '-')}", str(value)]
+
+        output = None if args.verbose else subprocess.DEVNULL
+        subprocess.run(command, check=True, stdout=output, stderr=output)
+        with open(result_path, "r", encoding="utf-8") as f:
+            runs.append(json.load(f))
+        os.remove(result_path)
+    return {"benchmark": "worker", "runs": runs}
+
+def worker_run_command(args: argparse.Namespace) -> Dict[str, Any]:
+    workdir = tempfile.mkdtemp(prefix="tome-benchmark-")
+    result = run_worker(args, workdir)
+    with open(args.result_file, "w", encoding="utf-8") as f:
+        json.dump(result, f)
+    shutil.rmtree(workdir, ignore_errors=True)
+    # Skip waiting for the worker thread; pending status updates were flushed above
+    os._exit(0)
+
+def chat_command(args: argparse.Namespace) -> Dict[str, Any]:
+    return {"benchmark": "chat", "runs": [asyncio.run(load_test_chat(args))]}
+
+def add_worker_arguments(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument("--assets", type=int, default=100, help="assets in the synthetic queue")
+    parser.add_argument("--documents", type=int, default=30, help="distinct source documents")
+    parser.add_argument("--sizes", default="small,medium,large", help="document sizes to mix: " + ", ".join(DOCUMENT_SIZES))
+    parser.add_argument("--tenants", type=int, default=5, help="organizations the assets are spread over")
+    parser.add_argument("--work-scale", type=float, default=0.01, help="scale of simulated rendering work")
+    parser.add_argument("--openai-latency", type=float, default=0.05)
+    parser.add_argument("--openai-error-rate", type=float, default=0.0, help="share of OpenAI calls answered with a 429")
+    parser.add_argument("--openai-rpm", type=int, default=100000, help="requests per minute budget given to the worker")
+    parser.add_argument("--db-latency", type=float, default=0.002)
+    parser.add_argument("--db-error-rate", type=float, default=0.0)
+    parser.add_argument("--storage-latency", type=float, default=0.002)
+    parser.add_argument("--storage-error-rate", type=float, default=0.0, help="share of upload parts that fail")
+    parser.add_argument("--download-latency", type=float, default=0.01)
+    parser.add_argument("--retry-seconds", type=float, default=0.5, help="base backoff before retrying a failed asset")
+    parser.add_argument("--timeout", type=float, default=600, help="give up on a run after this many seconds")
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark the TOME document worker and chat API.")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", help="write results to this file instead of stdout")
+    parser.add_argument("--verbose", action="store_true", help="show worker output")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    worker = commands.add_parser("worker", help="measure worker throughput and stage latency")
+    worker.add_argument("--modes", default="sequential,concurrent,pipeline")
+    add_worker_arguments(worker)
+    worker.set_defaults(handler=worker_command)
+
+    worker_run = commands.add_parser("worker-run", help=argparse.SUPPRESS)
+    worker_run.add_argument("--mode", required=True)
+    worker_run.add_argument("--result-file", required=True)
+    add_worker_arguments(worker_run)
+    worker_run.set_defaults(handler=worker_run_command)
+
+    chat = commands.add_parser("chat", help="load-test the /chat endpoint")
+    chat.add_argument("--requests", type=int, default=1000)
+    chat.add_argument("--concurrency", type=int, default=32)
+    chat.add_argument("--stream", action="store_true", help="use the streaming /chat/stream endpoint")
+    chat.set_defaults(handler=chat_command)
+
+    classifier = commands.add_parser("classifier", help="micro-benchmark chat message classification")
+    classifier.add_argument("--message-chars", default="100,1000,10000,100000", help="message lengths to test")
+    classifier.add_argument("--messages", type=int, default=200, help="distinct messages per length")
+    classifier.add_argument("--rounds", type=int, default=5)
+    classifier.set_defaults(handler=classifier_command)
+
+    args = parser.parse_args()
+    results = args.handler(args)
+    results.update({
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "seed": args.seed
+    })
+
+    payload = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(payload + "\n")
+    else:
+        print(payload)
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,14 @@
 import os
-from typing import List, Dict, Any, Optional
+import re
+import asyncio
+import hashlib
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+from typing import List, Dict, Any, Optional, AsyncIterator, NamedTuple
 from fastapi import FastAPI, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
 import openai
 import json
@@ -59,6 +66,11 @@ SAMPLE_WORKS = [
     }
 ]
 
+SAMPLES_BY_TYPE = {
+    sample_type: [sample for sample in SAMPLE_WORKS if sample["type"] == sample_type]
+    for sample_type in {sample["type"] for sample in SAMPLE_WORKS}
+}
+
 # Define request and response models
 class ChatMessage(BaseModel):
     role: str
@@ -73,107 +85,393 @@ class ChatResponse(BaseModel):
     message: ChatMessage
     samples: Optional[List[Dict[str, Any]]] = None
 
+INTENT_RESPONSES = {
+    "about": """TOME is a boutique content-creation agency that leverages the latest generative-AI engines to transform your standard operating procedures (SOPs), policy docs, and knowledge articles into polished, multi-format training assets. We deliver e-learning modules, avatar-based explainer videos, interactive process maps, and PDF job aids—all in as little as 72 hours. Every asset is reviewed by human instructional-design experts, so you get Silicon-speed production without sacrificing accuracy, compliance, or instructional value.""",
+    "pricing": """TOME uses a credit-based pricing model that scales with your needs. Instead of unpredictable hourly billing, you purchase monthly credit packs that give you flexibility and budget clarity. Our Starter package includes 50 credits per month, while Professional (150 credits) and Enterprise (500+ credits) tiers offer additional features and volume discounts. Unused credits roll over for one month, so your budget flexes with busy and quiet periods. Different asset types require different credit amounts: e-learning modules (10 credits), videos (15 credits), process maps (8 credits), and job aids (5 credits).""",
+    "how-it-works": """TOME works in four simple steps: 1) Submit - Upload your SOP or paste a SharePoint link into our secure portal and select which formats you want. 2) Specify - Answer three quick prompts about audience, tone, and must-keep compliance text. 3) Review - Within 48–72 hours you receive a preview link. You can approve or request up to two minor tweaks (included). 4) Launch - Download SCORM/xAPI, MP4, or high-res PDF files and drop them straight into your LMS or intranet. Behind the scenes, specialized AI pipelines power the transformation, but human QA ensures accuracy and accessibility.""",
+    "updates": """TOME makes updates and maintenance simple. For minor changes, just email us or drop the new document in the portal; we'll regenerate the affected screens at no additional credit cost within 60 days of the original creation. For major revamps, we'll quote the extra credit count upfront and queue the job automatically—no new statement of work needed. Because humans remain in the loop, you avoid AI hallucination risk and maintain a clean audit trail.""",
+    "examples": """I'd be happy to show you some examples of TOME's work! We create four types of training assets: 1) E-learning modules with interactive elements and knowledge checks, 2) Avatar-based explainer videos with professional narration, 3) Interactive process maps that visualize complex workflows, and 4) PDF job aids for quick reference. I'm displaying some samples now that you can click to preview. Would you like to see more examples of a specific format?""",
+    "benefits": """TOME offers several key advantages: 1) Speed + Quality - Three-day lead time plus enterprise-grade QA, 2) Zero IT Integration Required - A secure upload link is all it takes, 3) Fixed-Budget Clarity - Credits eliminate scope creep and procurement headaches, 4) Multi-format Delivery - One document in, four asset types out; no juggling point tools, 5) Human QA Safety Net - Every asset is checked, narrated, and visually polished before release. We're ideal for mid-size to enterprise organizations with frequent SOP updates, lean L&D teams needing to scale content output, and compliance-driven environments where stale training leads to audit findings.""",
+    "future": """TOME has an exciting roadmap ahead! In Q3 2025, we're launching multilingual pipelines for instant Spanish, French, and Mandarin localization at half the normal credit cost. Q4 2025 will bring opt-in auto-watch integration for SharePoint and Confluence. In H1 2026, we'll introduce a partner portal so external instructional-design agencies can burn credits on behalf of shared clients. Our long-term vision is to connect directly to your document libraries via secure API, automatically detecting changes and regenerating only the affected content—eliminating stale courses and creating a single, always-current source of truth.""",
+    "getting-started": """Getting started with TOME is easy! You can sign up for an account directly on our website and choose a credit package that fits your needs. We offer a small trial package for new customers who want to test our service with a single document before committing to a monthly plan. Once registered, you'll have immediate access to our secure portal where you can upload your first document and specify your requirements. Our team will guide you through the process, and you'll have your first training assets within 72 hours. Would you like me to show you some examples of what we can create?""",
+    "default": """Thank you for your interest in TOME! We transform standard operating procedures and documentation into engaging training assets in just 72 hours. Our AI-powered process, combined with human quality assurance, ensures accurate, compliant, and instructionally sound materials delivered at Silicon speed. We offer e-learning modules, avatar-based videos, interactive process maps, and PDF job aids through a simple credit-based pricing model. How can I help you learn more about our services?"""
+}
+
+# Message classification. The keyword lists are compiled at import into a
+# table of keyword label bitmasks and one regex with the keywords factored into
+# a trie, and classify_message finds every keyword in the lowercased message in
+# one pass. Each search restarts one character after the previous match, so
+# overlapping keywords are found. A keyword that is a prefix of a longer one
+# matched at the same position (e.g. "work" in "workflow") is covered by folding
+# its labels into the longer keyword's mask. Messages longer than
+# CLASSIFIER_SCAN_CHARS are instead checked keyword by keyword, in priority
+# order and stopping once the answer is known, as CPython's substring search
+# beats the regex engine on long text. Intents and sample types are listed in
+# priority order: the first one with a matching keyword wins.
+INTENT_KEYWORDS = [
+    ("about", ["what is tome", "about tome", "tell me about", "what does tome do"]),
+    ("pricing", ["pricing", "cost", "price", "how much", "credits"]),
+    ("how-it-works", ["how does it work", "process", "workflow", "steps", "how to use"]),
+    ("updates", ["update", "maintenance", "change", "revise", "edit"]),
+    ("examples", ["example", "sample", "showcase", "portfolio", "work"]),
+    ("benefits", ["benefit", "advantage", "why", "better", "different"]),
+    ("future", ["future", "roadmap", "coming soon", "plan", "next"]),
+    ("getting-started", ["start", "begin", "sign up", "register", "trial"])
+]
+
+# Keywords that mean the user wants to see sample works
+SAMPLE_REQUEST_KEYWORDS = ["example", "sample", "showcase", "portfolio", "work"]
+
+SAMPLE_TYPE_KEYWORDS = [
+    ("e-learning", ["e-learning", "elearning"]),
+    ("video", ["video"]),
+    ("process-map", ["process", "map"]),
+    ("job-aid", ["job", "aid", "pdf"])
+]
+
+CLASSIFIER_SCAN_CHARS = 2000
+
+class MessageClassification(NamedTuple):
+    intent: str
+    wants_samples: bool
+    sample_type: Optional[str]
+
+def keyword_trie_pattern(keywords: List[str]) -> str:
+    """Regex matching any of the keywords, factored into a trie so each position is checked in one step."""
+    trie: Dict[str, Any] = {}
+    for keyword in keywords:
+        node = trie
+        for char in keyword:
+            node = node.setdefault(char, {})
+        node[""] = {}
+    
+    def build(node: Dict[str, Any]) -> str:
+        branches = [re.escape(char) + build(child) for char, child in sorted(node.items()) if char]
+        if not branches:
+            return ""
+        pattern = branches[0] if len(branches) == 1 else "(?:" + "|".join(branches) + ")"
+        # Optional continuations are greedy, so the longest keyword at a position wins
+        return f"(?:{pattern})?" if "" in node else pattern
+    
+    return build(trie)
+
+def compile_classifier():
+    """Build the keyword regex, each keyword's label bitmask and the labels with their bits and keywords in priority order."""
+    keyword_labels = [(("intent", intent), keywords) for intent, keywords in INTENT_KEYWORDS]
+    keyword_labels += [(("samples", None), SAMPLE_REQUEST_KEYWORDS)]
+    keyword_labels += [(("sample_type", sample_type), keywords) for sample_type, keywords in SAMPLE_TYPE_KEYWORDS]
+    bits = {label: 1 << index for index, (label, _) in enumerate(keyword_labels)}
+    
+    masks: Dict[str, int] = {}
+    for label, keywords in keyword_labels:
+        for keyword in keywords:
+            masks[keyword] = masks.get(keyword, 0) | bits[label]
+    
+    # A match of a longer keyword also stands for every keyword that is its prefix
+    for keyword in masks:
+        for other in masks:
+            if other != keyword and keyword.startswith(other):
+                masks[keyword] |= masks[other]
+    
+    labels = [(label, bits[label], tuple(keywords)) for label, keywords in keyword_labels]
+    return re.compile(keyword_trie_pattern(list(masks))), masks, labels
+
+KEYWORD_PATTERN, KEYWORD_MASKS, LABELS = compile_classifier()
+SAMPLES_BIT = sum(bit for (kind, _), bit, _ in LABELS if kind == "samples")
+INTENT_BITS = sum(bit for (kind, _), bit, _ in LABELS if kind == "intent")
+SAMPLE_TYPE_BITS = sum(bit for (kind, _), bit, _ in LABELS if kind == "sample_type")
+
+def find_keywords(text: str) -> int:
+    """Bitmask of the labels of the keywords found in already lowercased text."""
+    found = 0
+    if len(text) > CLASSIFIER_SCAN_CHARS:
+        # Only the first intent and sample type in priority order are needed
+        for (kind, _), bit, keywords in LABELS:
+            if kind == "intent" and found & INTENT_BITS or kind == "sample_type" and found & SAMPLE_TYPE_BITS:
+                continue
+            if any(keyword in text for keyword in keywords):
+                found |= bit
+        return found
+    
+    search = KEYWORD_PATTERN.search
+    match = search(text)
+    while match:
+        found |= KEYWORD_MASKS[match.group()]
+        match = search(text, match.start() + 1)
+    return found
+
+def classify_message(message: str) -> MessageClassification:
+    """Classify a user message's intent and requested sample type."""
+    found = find_keywords(message.lower())
+    
+    intent = "default"
+    sample_type = None
+    for (kind, value), bit, _ in LABELS:
+        if not found & bit:
+            continue
+        if kind == "intent" and intent == "default":
+            intent = value
+        elif kind == "sample_type" and sample_type is None:
+            sample_type = value
+    
+    return MessageClassification(intent, bool(found & SAMPLES_BIT), sample_type)
+
+SYSTEM_PROMPT = """You are an AI assistant for TOME, a boutique content-creation agency that leverages AI to transform SOPs, policy docs, and knowledge articles into polished training assets. 
+                Be helpful, concise, and informative. Focus on explaining how TOME works, the benefits of the service, and answer questions about pricing, process, and capabilities.
+                When asked about examples or samples, mention that you can show examples of e-learning modules, videos, process maps, and job aids."""
+
+# Delay between streamed tokens of a simulated response, mimicking LLM generation
+STREAM_TOKEN_DELAY_SECONDS = float(os.getenv("STREAM_TOKEN_DELAY_SECONDS", "0.02"))
+
+# Conversation history. Clients send the whole conversation on every turn, so
+# before it is sent to the LLM it is fitted into HISTORY_TOKEN_BUDGET tokens.
+# System messages and the most recent turns are kept verbatim. Older turns are
+# replaced by a rolling summary, built one block of SUMMARY_BLOCK_MESSAGES at a
+# time from the previous block's summary. Block summaries are cached under a
+# hash of the conversation prefix they cover, so each block of a conversation
+# is summarized once however many more turns follow.
+CHAT_MODEL = os.getenv("CHAT_MODEL", "gpt-4o")
+HISTORY_TOKEN_BUDGET = int(os.getenv("HISTORY_TOKEN_BUDGET", "3000"))
+SUMMARY_BLOCK_MESSAGES = int(os.getenv("SUMMARY_BLOCK_MESSAGES", "8"))
+SUMMARY_TOKEN_LIMIT = int(os.getenv("SUMMARY_TOKEN_LIMIT", "400"))
+SUMMARY_CACHE_ENTRIES = int(os.getenv("SUMMARY_CACHE_ENTRIES", "4096"))
+# Tokens of framing the chat format adds to every message
+MESSAGE_OVERHEAD_TOKENS = 4
+
+@lru_cache(maxsize=1)
+def token_encoder():
+    """The model's tokenizer if tiktoken is installed, else None."""
+    try:
+        import tiktoken
+    except ImportError:
+        return None
+    
+    try:
+        return tiktoken.encoding_for_model(CHAT_MODEL)
+    except KeyError:
+        return tiktoken.get_encoding("cl100k_base")
+
+def count_tokens(text: str) -> int:
+    encoder = token_encoder()
+    if encoder is None:
+        # Roughly four characters per token for English text
+        return (len(text) + 3) // 4
+    return len(encoder.encode(text, disallowed_special=()))
+
+def message_tokens(message: Dict[str, str]) -> int:
+    return count_tokens(message["content"]) + MESSAGE_OVERHEAD_TOKENS
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    """Keep the end of a text that does not fit in `max_tokens`."""
+    encoder = token_encoder()
+    if encoder is None:
+        return text[-max_tokens * 4:] if max_tokens > 0 else ""
+    tokens = encoder.encode(text, disallowed_special=())
+    return encoder.decode(tokens[-max_tokens:]) if max_tokens > 0 else ""
+
+class SummaryCache:
+    """LRU cache of conversation summaries keyed by conversation prefix hash."""
+
+    def __init__(self, max_entries: int = SUMMARY_CACHE_ENTRIES):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[str, str]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            summary = self._entries.get(key)
+            if summary is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return summary
+
+    def put(self, key: str, summary: str) -> None:
+        with self._lock:
+            self._entries[key] = summary
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+summary_cache = SummaryCache()
+
+def summarize_messages(previous_summary: str, messages: List[Dict[str, str]]) -> str:
+    """Fold a block of messages into the running summary of the conversation."""
+    # In a real implementation, this would ask the LLM to update the summary
+    # with the new messages. For now, keep the first sentence of each message
+    points = []
+    for message in messages:
+        first_sentence = re.split(r"(?<=[.!?])\s", message["content"].strip(), maxsplit=1)[0]
+        points.append(f"{message['role'].capitalize()}: {first_sentence}")
+    
+    summary = " ".join(filter(None, [previous_summary] + points))
+    return truncate_to_tokens(summary, SUMMARY_TOKEN_LIMIT)
+
+def summarize_prefix(messages: List[Dict[str, str]]) -> str:
+    """Rolling summary of the messages, one cached block at a time."""
+    summary = ""
+    prefix_hash = hashlib.sha256(CHAT_MODEL.encode("utf-8"))
+    
+    for start in range(0, len(messages), SUMMARY_BLOCK_MESSAGES):
+        block = messages[start:start + SUMMARY_BLOCK_MESSAGES]
+        prefix_hash.update(json.dumps(block, sort_keys=True).encode("utf-8"))
+        key = prefix_hash.hexdigest()
+        
+        cached = summary_cache.get(key)
+        if cached is None:
+            cached = summarize_messages(summary, block)
+            summary_cache.put(key, cached)
+        summary = cached
+    
+    return summary
+
+def fit_history(messages: List[Dict[str, str]], budget: int = HISTORY_TOKEN_BUDGET) -> List[Dict[str, str]]:
+    """Fit a conversation into `budget` tokens, summarizing the turns that do not fit verbatim."""
+    system = [message for message in messages if message["role"] == "system"]
+    turns = [message for message in messages if message["role"] != "system"]
+    sizes = [message_tokens(message) for message in turns]
+    available = budget - sum(message_tokens(message) for message in system)
+    
+    if not turns or sum(sizes) <= available:
+        return messages
+    
+    # Keep as many recent turns as fit next to a full-size summary
+    available -= SUMMARY_TOKEN_LIMIT + MESSAGE_OVERHEAD_TOKENS
+    cut = len(turns) - 1
+    kept = sizes[-1]
+    while cut > 0 and kept + sizes[cut - 1] <= available:
+        cut -= 1
+        kept += sizes[cut]
+    
+    recent = [dict(message) for message in turns[cut:]]
+    if kept > available:
+        # A single message larger than the budget keeps only its end
+        recent[-1]["content"] = truncate_to_tokens(recent[-1]["content"], max(0, available - MESSAGE_OVERHEAD_TOKENS))
+    
+    fitted = list(system)
+    if cut:
+        # Whole blocks come from the cached rolling summary; the turns between
+        # the last block boundary and the cut are folded in without caching
+        boundary = cut // SUMMARY_BLOCK_MESSAGES * SUMMARY_BLOCK_MESSAGES
+        summary = summarize_prefix(turns[:boundary])
+        if boundary < cut:
+            summary = summarize_messages(summary, turns[boundary:cut])
+        fitted.append({"role": "system", "content": f"Summary of the earlier conversation: {summary}"})
+    return fitted + recent
+
+def build_messages(request: ChatRequest) -> List[Dict[str, str]]:
+    """Convert the request into LLM messages, adding the system prompt if it is missing."""
+    messages = [{"role": msg.role, "content": msg.content} for msg in request.messages]
+    
+    # Add system message if not present
+    if not any(msg["role"] == "system" for msg in messages):
+        messages.insert(0, {"role": "system", "content": SYSTEM_PROMPT})
+    
+    return messages
+
+def last_user_message(messages: List[Dict[str, str]]) -> str:
+    return next((msg["content"] for msg in reversed(messages) if msg["role"] == "user"), "")
+
+def select_samples(request: ChatRequest, classification: MessageClassification) -> Optional[List[Dict[str, Any]]]:
+    """Pick the sample works to show alongside the response, if any."""
+    # Determine if we should show samples
+    show_samples = request.show_samples
+    sample_type = request.sample_type
+    
+    # If the user asks about examples or samples, show them, of the type mentioned if any
+    if classification.wants_samples:
+        show_samples = True
+        sample_type = classification.sample_type or sample_type
+    
+    # Filter samples if a specific type is requested
+    if not show_samples:
+        return None
+    if sample_type:
+        return SAMPLES_BY_TYPE.get(sample_type, [])
+    return SAMPLE_WORKS
+
 # Chat endpoint
 @app.post("/chat", response_model=ChatResponse)
 async def chat(request: ChatRequest):
     try:
         # Process the chat request
-        messages = [{"role": msg.role, "content": msg.content} for msg in request.messages]
-        
-        # Add system message if not present
-        if not any(msg["role"] == "system" for msg in messages):
-            messages.insert(0, {
-                "role": "system",
-                "content": """You are an AI assistant for TOME, a boutique content-creation agency that leverages AI to transform SOPs, policy docs, and knowledge articles into polished training assets. 
-                Be helpful, concise, and informative. Focus on explaining how TOME works, the benefits of the service, and answer questions about pricing, process, and capabilities.
-                When asked about examples or samples, mention that you can show examples of e-learning modules, videos, process maps, and job aids."""
-            })
+        messages = build_messages(request)
+        user_message = last_user_message(messages)
+        classification = classify_message(user_message)
         
-        # Call OpenAI API for chat completion
-        # In a real implementation, this would use the actual OpenAI API
-        # For now, we'll simulate the response
-        
-        # Simulate OpenAI response based on the last user message
-        last_user_message = next((msg["content"] for msg in reversed(messages) if msg["role"] == "user"), "")
+        # Call OpenAI API for chat completion with the history fitted to the
+        # token budget
+        # In a real implementation, this would send prompt_messages to the
+        # actual OpenAI API. For now, we'll simulate the response based on the
+        # last user message
+        prompt_messages = fit_history(messages)
         
         # Generate appropriate response based on user query
-        response_content = generate_simulated_response(last_user_message)
-        
-        # Determine if we should show samples
-        show_samples = request.show_samples
-        sample_type = request.sample_type
-        
-        # If the user asks about examples or samples, set show_samples to True
-        if any(keyword in last_user_message.lower() for keyword in ["example", "sample", "showcase", "portfolio", "work"]):
-            show_samples = True
-            
-            # Try to determine the sample type from the message
-            if "e-learning" in last_user_message.lower() or "elearning" in last_user_message.lower():
-                sample_type = "e-learning"
-            elif "video" in last_user_message.lower():
-                sample_type = "video"
-            elif "process" in last_user_message.lower() or "map" in last_user_message.lower():
-                sample_type = "process-map"
-            elif "job" in last_user_message.lower() or "aid" in last_user_message.lower() or "pdf" in last_user_message.lower():
-                sample_type = "job-aid"
-        
-        # Filter samples if a specific type is requested
-        samples = SAMPLE_WORKS
-        if show_samples and sample_type:
-            samples = [sample for sample in SAMPLE_WORKS if sample["type"] == sample_type]
-        elif not show_samples:
-            samples = None
+        response_content = generate_simulated_response(last_user_message(prompt_messages), classification)
         
         return ChatResponse(
             message=ChatMessage(role="assistant", content=response_content),
-            samples=samples
+            samples=select_samples(request, classification)
         )
         
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-def generate_simulated_response(user_message: str) -> str:
-    """Generate a simulated response based on the user message."""
-    # Convert to lowercase for easier matching
-    user_message_lower = user_message.lower()
-    
-    # Check for different types of queries and return appropriate responses
-    
-    # About TOME
-    if any(keyword in user_message_lower for keyword in ["what is tome", "about tome", "tell me about", "what does tome do"]):
-        return """TOME is a boutique content-creation agency that leverages the latest generative-AI engines to transform your standard operating procedures (SOPs), policy docs, and knowledge articles into polished, multi-format training assets. We deliver e-learning modules, avatar-based explainer videos, interactive process maps, and PDF job aids—all in as little as 72 hours. Every asset is reviewed by human instructional-design experts, so you get Silicon-speed production without sacrificing accuracy, compliance, or instructional value."""
-    
-    # Pricing
-    elif any(keyword in user_message_lower for keyword in ["pricing", "cost", "price", "how much", "credits"]):
-        return """TOME uses a credit-based pricing model that scales with your needs. Instead of unpredictable hourly billing, you purchase monthly credit packs that give you flexibility and budget clarity. Our Starter package includes 50 credits per month, while Professional (150 credits) and Enterprise (500+ credits) tiers offer additional features and volume discounts. Unused credits roll over for one month, so your budget flexes with busy and quiet periods. Different asset types require different credit amounts: e-learning modules (10 credits), videos (15 credits), process maps (8 credits), and job aids (5 credits)."""
-    
-    # How it works
-    elif any(keyword in user_message_lower for keyword in ["how does it work", "process", "workflow", "steps", "how to use"]):
-        return """TOME works in four simple steps: 1) Submit - Upload your SOP or paste a SharePoint link into our secure portal and select which formats you want. 2) Specify - Answer three quick prompts about audience, tone, and must-keep compliance text. 3) Review - Within 48–72 hours you receive a preview link. You can approve or request up to two minor tweaks (included). 4) Launch - Download SCORM/xAPI, MP4, or high-res PDF files and drop them straight into your LMS or intranet. Behind the scenes, specialized AI pipelines power the transformation, but human QA ensures accuracy and accessibility."""
-    
-    # Updates and maintenance
-    elif any(keyword in user_message_lower for keyword in ["update", "maintenance", "change", "revise", "edit"]):
-        return """TOME makes updates and maintenance simple. For minor changes, just email us or drop the new document in the portal; we'll regenerate the affected screens at no additional credit cost within 60 days of the original creation. For major revamps, we'll quote the extra credit count upfront and queue the job automatically—no new statement of work needed. Because humans remain in the loop, you avoid AI hallucination risk and maintain a clean audit trail."""
-    
-    # Examples or samples
-    elif any(keyword in user_message_lower for keyword in ["example", "sample", "showcase", "portfolio", "work"]):
-        return """I'd be happy to show you some examples of TOME's work! We create four types of training assets: 1) E-learning modules with interactive elements and knowledge checks, 2) Avatar-based explainer videos with professional narration, 3) Interactive process maps that visualize complex workflows, and 4) PDF job aids for quick reference. I'm displaying some samples now that you can click to preview. Would you like to see more examples of a specific format?"""
-    
-    # Benefits or advantages
-    elif any(keyword in user_message_lower for keyword in ["benefit", "advantage", "why", "better", "different"]):
-        return """TOME offers several key advantages: 1) Speed + Quality - Three-day lead time plus enterprise-grade QA, 2) Zero IT Integration Required - A secure upload link is all it takes, 3) Fixed-Budget Clarity - Credits eliminate scope creep and procurement headaches, 4) Multi-format Delivery - One document in, four asset types out; no juggling point tools, 5) Human QA Safety Net - Every asset is checked, narrated, and visually polished before release. We're ideal for mid-size to enterprise organizations with frequent SOP updates, lean L&D teams needing to scale content output, and compliance-driven environments where stale training leads to audit findings."""
-    
-    # Future plans
-    elif any(keyword in user_message_lower for keyword in ["future", "roadmap", "coming soon", "plan", "next"]):
-        return """TOME has an exciting roadmap ahead! In Q3 2025, we're launching multilingual pipelines for instant Spanish, French, and Mandarin localization at half the normal credit cost. Q4 2025 will bring opt-in auto-watch integration for SharePoint and Confluence. In H1 2026, we'll introduce a partner portal so external instructional-design agencies can burn credits on behalf of shared clients. Our long-term vision is to connect directly to your document libraries via secure API, automatically detecting changes and regenerating only the affected content—eliminating stale courses and creating a single, always-current source of truth."""
+async def stream_response_tokens(messages: List[Dict[str, str]], classification: MessageClassification) -> AsyncIterator[str]:
+    """Yield the assistant response token by token as it is generated."""
+    # In a real implementation, this would iterate over
+    # openai.chat.completions.create(..., stream=True) and yield each delta
+    response_content = generate_simulated_response(last_user_message(messages), classification)
+    for token in re.findall(r"\S+\s*|\s+", response_content):
+        yield token
+        await asyncio.sleep(STREAM_TOKEN_DELAY_SECONDS)
+
+def format_event(event: str, data: Any, ndjson: bool) -> str:
+    """Encode one stream event as a Server-Sent Event or an NDJSON line."""
+    if ndjson:
+        return json.dumps({"event": event, "data": data}) + "\n"
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+# Streaming chat endpoint. Sends the response as it is generated: a "samples"
+# event first carries the sample works to show (or null), since they are known
+# before generation starts, then "token" events carry pieces of the message
+# text, and a final "done" event carries the complete message. Responses are Server-Sent Events unless the client accepts
+# application/x-ndjson, in which case each event is one JSON line.
+@app.post("/chat/stream")
+async def chat_stream(request: ChatRequest, http_request: Request):
+    messages = build_messages(request)
+    classification = classify_message(last_user_message(messages))
+    prompt_messages = fit_history(messages)
+    ndjson = "application/x-ndjson" in http_request.headers.get("accept", "")
     
-    # Getting started
-    elif any(keyword in user_message_lower for keyword in ["start", "begin", "sign up", "register", "trial"]):
-        return """Getting started with TOME is easy! You can sign up for an account directly on our website and choose a credit package that fits your needs. We offer a small trial package for new customers who want to test our service with a single document before committing to a monthly plan. Once registered, you'll have immediate access to our secure portal where you can upload your first document and specify your requirements. Our team will guide you through the process, and you'll have your first training assets within 72 hours. Would you like me to show you some examples of what we can create?"""
+    async def events() -> AsyncIterator[str]:
+        tokens = []
+        try:
+            yield format_event("samples", select_samples(request, classification), ndjson)
+            
+            async for token in stream_response_tokens(prompt_messages, classification):
+                tokens.append(token)
+                yield format_event("token", token, ndjson)
+            
+            yield format_event("done", {"message": {"role": "assistant", "content": "".join(tokens)}}, ndjson)
+        except Exception as e:
+            # Headers are already sent, so errors are reported in-band
+            yield format_event("error", {"detail": str(e)}, ndjson)
     
-    # Default response for other queries
-    else:
-        return """Thank you for your interest in TOME! We transform standard operating procedures and documentation into engaging training assets in just 72 hours. Our AI-powered process, combined with human quality assurance, ensures accurate, compliant, and instructionally sound materials delivered at Silicon speed. We offer e-learning modules, avatar-based videos, interactive process maps, and PDF job aids through a simple credit-based pricing model. How can I help you learn more about our services?"""
+    return StreamingResponse(
+        events(),
+        media_type="application/x-ndjson" if ndjson else "text/event-stream",
+        # Keep proxies from buffering the stream
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+def generate_simulated_response(user_message: str, classification: Optional[MessageClassification] = None) -> str:
+    """Generate a simulated response based on the user message."""
+    classification = classification or classify_message(user_message)
+    return INTENT_RESPONSES[classification.intent]
 
 # Health check endpoint
 @app.get("/health")
@@ -2,18 +2,66 @@ import os
 import sys
 import json
 import time
-import requests
-from typing import Dict, Any, List, Optional
-import openai
-from supabase import create_client, Client
+IMPORT_STARTED_AT = time.perf_counter()
+import atexit
+import signal
+import re
+import html
+import fcntl
+import random
+import shutil
+import socket
+import hashlib
+import tempfile
+import threading
+import traceback
+import argparse
+import io
+from collections import OrderedDict, Counter
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from concurrent.futures import ThreadPoolExecutor, Future, FIRST_COMPLETED, wait
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Any, List, Optional, Callable, Tuple, Iterable, Iterator, IO
 
-# Initialize Supabase client
+# Clients. The Supabase and OpenAI clients, and the libraries behind them, are
+# only loaded the first time they are used, so the worker starts quickly when
+# it is invoked from cron or a serverless function (see --drain below) and a
+# run that finds no work never pays for them.
 supabase_url = os.getenv("SUPABASE_URL", "https://example.supabase.co")
 supabase_key = os.getenv("SUPABASE_KEY", "your-service-role-key")
-supabase: Client = create_client(supabase_url, supabase_key)
 
-# Initialize OpenAI client
-openai.api_key = os.getenv("OPENAI_API_KEY", "your-openai-api-key")
+class LazyClient:
+    """Stands in for a client and creates it on first attribute access."""
+
+    def __init__(self, factory: Callable[[], Any]):
+        self._factory = factory
+        self._client = None
+        self._lock = threading.Lock()
+
+    def get(self) -> Any:
+        if self._client is None:
+            with self._lock:
+                if self._client is None:
+                    self._client = self._factory()
+        return self._client
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self.get(), name)
+
+def create_supabase_client() -> Any:
+    from supabase import create_client
+    return create_client(supabase_url, supabase_key)
+
+def create_openai_client() -> Any:
+    import openai
+    openai.api_key = os.getenv("OPENAI_API_KEY", "your-openai-api-key")
+    # Retries are handled by the rate limiter so they share its backoff
+    openai.max_retries = 0
+    return openai
+
+supabase = LazyClient(create_supabase_client)
+openai_client = LazyClient(create_openai_client)
 
 # Asset types and their processing functions
 ASSET_TYPES = {
@@ -23,38 +71,620 @@ ASSET_TYPES = {
     "job-aid": "process_job_aid"
 }
 
-def fetch_pending_assets() -> List[Dict[str, Any]]:
-    """Fetch pending assets from Supabase."""
-    response = supabase.table("assets").select("*").eq("status", "processing").execute()
+# Worker execution mode. "sequential" processes one asset at a time; "concurrent"
+# runs up to WORKER_CONCURRENCY assets at once, with a separate limit per asset
+# type so a burst of slow videos cannot occupy every slot. "pipeline" works like
+# "concurrent" but groups assets by source document, extracting and outlining
+# each document once before fanning out to every asset type ordered from it.
+WORKER_MODE = os.getenv("WORKER_MODE", "sequential")
+WORKER_CONCURRENCY = int(os.getenv("WORKER_CONCURRENCY", "8"))
+ASSET_TYPE_CONCURRENCY = {
+    "e-learning": int(os.getenv("ELEARNING_CONCURRENCY", "4")),
+    "video": int(os.getenv("VIDEO_CONCURRENCY", "2")),
+    "process-map": int(os.getenv("PROCESS_MAP_CONCURRENCY", "4")),
+    "job-aid": int(os.getenv("JOB_AID_CONCURRENCY", "4"))
+}
+
+# Metrics. The worker records per-stage latency histograms labeled by asset
+# type, the queue depth and age seen at the last claim, in-flight assets, asset
+# outcomes and cache hit counts. Setting METRICS_PORT serves them in the
+# Prometheus text format on /metrics. Stages nest: "generate" covers a whole
+# processing function, including the "llm" and "upload" calls made inside it.
+# With PROFILE_SLOW_ASSET_SECONDS set, an asset still running after that long
+# has its thread's stack sampled until it finishes. The folded stacks are
+# written to PROFILE_DIR, ready for flamegraph tools.
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+PROFILE_SLOW_ASSET_SECONDS = float(os.getenv("PROFILE_SLOW_ASSET_SECONDS", "0"))
+PROFILE_SAMPLE_SECONDS = float(os.getenv("PROFILE_SAMPLE_SECONDS", "0.01"))
+PROFILE_DIR = os.getenv("PROFILE_DIR", os.path.join(tempfile.gettempdir(), "tome-profiles"))
+
+def format_labels(labels: Dict[str, Any]) -> str:
+    if not labels:
+        return ""
+    escape = lambda value: str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+    return "{" + ",".join(f'{name}="{escape(value)}"' for name, value in sorted(labels.items())) + "}"
+
+class WorkerMetrics:
+    """Thread-safe registry of the worker's histograms, counters and gauges."""
+
+    def __init__(self, buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        self.buckets = buckets
+        # Histogram state per (stage, asset type): bucket counts, sum and count
+        self.stage_latency: Dict[Tuple[str, str], List[Any]] = {}
+        self.counters: Counter = Counter()
+        self.gauges: Dict[Tuple[str, Tuple[Tuple[str, Any], ...]], float] = {}
+        self.collectors: List[Callable[[], Iterable[Tuple[str, str, Dict[str, Any], float]]]] = []
+        # Raw stage durations, kept only when exact percentiles are needed (e.g. benchmarks)
+        self.samples: Optional[Dict[Tuple[str, str], List[float]]] = None
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    def observe_stage(self, stage: str, asset_type: str, seconds: float) -> None:
+        with self._lock:
+            state = self.stage_latency.setdefault((stage, asset_type), [[0] * len(self.buckets), 0.0, 0])
+            for index, bound in enumerate(self.buckets):
+                if seconds <= bound:
+                    state[0][index] += 1
+            state[1] += seconds
+            state[2] += 1
+            if self.samples is not None:
+                self.samples.setdefault((stage, asset_type), []).append(seconds)
+
+    def keep_samples(self) -> None:
+        """Start keeping every stage duration in addition to the histogram buckets."""
+        with self._lock:
+            if self.samples is None:
+                self.samples = {}
+
+    @contextmanager
+    def timed(self, stage: str, asset_type: Optional[str] = None):
+        """Time a block as `stage`, labeled with the asset type being processed on this thread by default."""
+        started_at = time.time()
+        try:
+            yield
+        finally:
+            label = asset_type or getattr(self._local, "asset_type", None) or "none"
+            self.observe_stage(stage, label, time.time() - started_at)
+
+    def increment(self, name: str, amount: float = 1, **labels: Any) -> None:
+        with self._lock:
+            self.counters[(name, tuple(sorted(labels.items())))] += amount
+
+    def set_gauge(self, name: str, value: float, **labels: Any) -> None:
+        with self._lock:
+            self.gauges[(name, tuple(sorted(labels.items())))] = value
+
+    def add_gauge(self, name: str, amount: float, **labels: Any) -> None:
+        with self._lock:
+            key = (name, tuple(sorted(labels.items())))
+            self.gauges[key] = self.gauges.get(key, 0) + amount
+
+    def collector(self, collect: Callable[[], Iterable[Tuple[str, str, Dict[str, Any], float]]]) -> None:
+        """Register a callback producing (name, type, labels, value) samples at scrape time."""
+        self.collectors.append(collect)
+
+    @contextmanager
+    def track_asset(self, asset: Dict[str, Any]):
+        """Count an asset as in flight on this thread, and profile it if it runs slow."""
+        asset_type = asset.get("asset_type") or "none"
+        previous = getattr(self._local, "asset_type", None)
+        self._local.asset_type = asset_type
+        self.add_gauge("tome_assets_in_flight", 1, asset_type=asset_type)
+        try:
+            with slow_asset_profiler.track(asset):
+                yield
+        finally:
+            self.add_gauge("tome_assets_in_flight", -1, asset_type=asset_type)
+            self._local.asset_type = previous
+
+    def render(self) -> str:
+        """Render every metric in the Prometheus text exposition format."""
+        lines = ["# TYPE tome_stage_seconds histogram"]
+        with self._lock:
+            for (stage, asset_type), (counts, total, count) in sorted(self.stage_latency.items()):
+                labels = {"stage": stage, "asset_type": asset_type}
+                for bound, bucket_count in zip(self.buckets, counts):
+                    lines.append(f"tome_stage_seconds_bucket{format_labels({**labels, 'le': bound})} {bucket_count}")
+                lines.append(f"tome_stage_seconds_bucket{format_labels({**labels, 'le': '+Inf'})} {count}")
+                lines.append(f"tome_stage_seconds_sum{format_labels(labels)} {total}")
+                lines.append(f"tome_stage_seconds_count{format_labels(labels)} {count}")
+            samples = [(name, "counter", dict(labels), value) for (name, labels), value in self.counters.items()]
+            samples += [(name, "gauge", dict(labels), value) for (name, labels), value in self.gauges.items()]
+        
+        for collect in self.collectors:
+            try:
+                samples.extend(collect())
+            except Exception as e:
+                print(f"Error collecting metrics: {str(e)}")
+        
+        declared = set()
+        for name, kind, labels, value in sorted(samples, key=lambda sample: (sample[0], sorted(sample[2].items()))):
+            if name not in declared:
+                lines.append(f"# TYPE {name} {kind}")
+                declared.add(name)
+            lines.append(f"{name}{format_labels(labels)} {value}")
+        return "\n".join(lines) + "\n"
+
+class SlowAssetProfiler:
+    """Sampling profiler that only samples the threads of assets running longer than a threshold."""
+
+    def __init__(self, threshold_seconds: float = PROFILE_SLOW_ASSET_SECONDS, interval: float = PROFILE_SAMPLE_SECONDS,
+                 directory: str = PROFILE_DIR):
+        self.threshold = threshold_seconds
+        self.interval = interval
+        self.directory = directory
+        # Thread ident -> (asset, started at, folded stack counts)
+        self._tracked: Dict[int, Tuple[Dict[str, Any], float, Counter]] = {}
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+
+    def _start(self) -> None:
+        with self._lock:
+            if self._thread is None:
+                os.makedirs(self.directory, exist_ok=True)
+                self._thread = threading.Thread(target=self._run, name="slow-asset-profiler", daemon=True)
+                self._thread.start()
+
+    @contextmanager
+    def track(self, asset: Dict[str, Any]):
+        if self.threshold <= 0:
+            yield
+            return
+        
+        self._start()
+        ident = threading.get_ident()
+        samples: Counter = Counter()
+        with self._lock:
+            self._tracked[ident] = (asset, time.time(), samples)
+        try:
+            yield
+        finally:
+            with self._lock:
+                del self._tracked[ident]
+            if samples:
+                self._report(asset, samples)
+
+    def _run(self) -> None:
+        while True:
+            time.sleep(self.interval)
+            now = time.time()
+            with self._lock:
+                slow = [(ident, samples) for ident, (_, started_at, samples) in self._tracked.items()
+                        if now - started_at >= self.threshold]
+            if not slow:
+                continue
+            
+            frames = sys._current_frames()
+            for ident, samples in slow:
+                frame = frames.get(ident)
+                if frame is not None:
+                    stack = traceback.extract_stack(frame)
+                    samples[";".join(f"{entry.name} ({os.path.basename(entry.filename)}:{entry.lineno})" for entry in stack)] += 1
+
+    def _report(self, asset: Dict[str, Any], samples: Counter) -> None:
+        path = os.path.join(self.directory, f"{asset['id']}-{int(time.time())}.folded")
+        with open(path, "w", encoding="utf-8") as f:
+            for stack, count in samples.most_common():
+                f.write(f"{stack} {count}\n")
+        
+        hottest = samples.most_common(1)[0][0].rsplit(";", 1)[-1]
+        print(f"Slow asset {asset['id']} ({asset.get('asset_type')}): {sum(samples.values())} samples, hottest frame {hottest}, profile written to {path}")
+
+class MetricsServer:
+    """Minimal HTTP server exposing the worker metrics on /metrics."""
+
+    def __init__(self, registry: WorkerMetrics, port: int = METRICS_PORT):
+        registry_ref = registry
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                pass
+
+            def do_GET(self):
+                if self.path.split("?")[0] != "/metrics":
+                    self.send_error(404)
+                    return
+                payload = registry_ref.render().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+        self._server = ThreadingHTTPServer(("0.0.0.0", port), Handler)
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, name="metrics-server", daemon=True)
+
+    @property
+    def port(self) -> int:
+        return self._server.server_address[1]
+
+    def start(self) -> "MetricsServer":
+        self._thread.start()
+        print(f"Serving metrics on port {self.port}")
+        return self
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+def collect_cache_metrics() -> Iterator[Tuple[str, str, Dict[str, Any], float]]:
+    """Hit and miss counts of the worker's caches."""
+    extraction = extraction_cache.stats()
+    yield ("tome_cache_requests_total", "counter", {"cache": "extraction", "result": "hit"},
+           extraction["memory_hits"] + extraction["disk_hits"])
+    yield ("tome_cache_requests_total", "counter", {"cache": "extraction", "result": "miss"}, extraction["misses"])
     
-    if response.data:
-        print(f"Found {len(response.data)} pending assets")
-        return response.data
+    completions = completion_cache.stats()
+    yield ("tome_cache_requests_total", "counter", {"cache": "completion", "result": "hit"},
+           completions["memory_hits"] + completions["disk_hits"] + completions["shared_requests"])
+    # A request served by an identical in-flight call missed the store first
+    yield ("tome_cache_requests_total", "counter", {"cache": "completion", "result": "miss"},
+           completions["misses"] - completions["shared_requests"])
     
-    return []
+    yield ("tome_uploads_deduplicated_total", "counter", {}, output_uploader.deduplicated)
+    yield ("tome_checkpoint_resumes_total", "counter", {}, checkpoint_store.resumed)
+    yield ("tome_status_updates_pending", "gauge", {}, status_sink.pending())
+
+metrics = WorkerMetrics()
+slow_asset_profiler = SlowAssetProfiler()
+metrics.collector(collect_cache_metrics)
 
-def update_asset_status(asset_id: str, status: str, output_url: Optional[str] = None) -> None:
-    """Update the status of an asset in Supabase."""
-    update_data = {"status": status}
+# Job claiming. Each worker claims assets by stamping them with its WORKER_ID
+# and a lease expiry, and keeps the lease alive with heartbeats while it works.
+# A lease that is not renewed (e.g. the worker crashed) expires and the asset
+# becomes claimable by any other worker. Claims and renewals go through the
+# claim_assets and renew_leases database functions, which take a batch of
+# assets in one round trip, skip rows another worker is claiming at that moment
+# and compute lease expiry with the database clock, so workers whose clocks
+# disagree never take each other's live leases.
+WORKER_ID = os.getenv("WORKER_ID") or f"{socket.gethostname()}-{os.getpid()}"
+LEASE_SECONDS = int(os.getenv("LEASE_SECONDS", "300"))
+
+def utc_timestamp(offset_seconds: float = 0) -> str:
+    """Return an ISO 8601 UTC timestamp, optionally offset into the future."""
+    moment = datetime.now(timezone.utc) + timedelta(seconds=offset_seconds)
+    return moment.strftime("%Y-%m-%dT%H:%M:%S.%fZ")
+
+def fetch_claim_candidates(limit: int, per_tenant: Optional[int] = None) -> List[Dict[str, Any]]:
+    """Fetch the oldest claimable assets of every tenant, with just the columns needed to schedule them.
+    
+    The claim_candidates database function takes at most `per_tenant` assets
+    from each tenant (organization, or user without one), so one tenant's
+    backlog never crowds the others out of the window. The window holds every
+    tenant's oldest asset before any tenant's second, and so on.
+    """
+    response = supabase.rpc("claim_candidates", {
+        "per_tenant": per_tenant or limit,
+        "n": limit
+    }).execute()
+    candidates = response.data or []
+    
+    # Depth is capped at `limit`, the largest window the worker looks at
+    created = [parse_timestamp(candidate.get("created_at")) for candidate in candidates]
+    created = [timestamp for timestamp in created if timestamp is not None]
+    metrics.set_gauge("tome_queue_depth", len(candidates))
+    metrics.set_gauge("tome_queue_oldest_age_seconds", time.time() - min(created) if created else 0)
+    return candidates
+
+def claim_assets(candidates: List[Dict[str, Any]], limit: int, worker_id: str = WORKER_ID,
+                 lease_seconds: int = LEASE_SECONDS) -> List[Dict[str, Any]]:
+    """Claim up to `limit` of the candidates, in order, for this worker."""
+    if limit <= 0 or not candidates:
+        return []
+    
+    # A single conditional update over the batch: it only takes assets that are
+    # still claimable, so exactly one worker wins each asset
+    response = supabase.rpc("claim_assets", {
+        "worker": worker_id,
+        "n": limit,
+        "lease_seconds": lease_seconds,
+        "candidates": [candidate["id"] for candidate in candidates]
+    }).execute()
+    # The database returns claimed rows in no particular order
+    position = {str(candidate["id"]): index for index, candidate in enumerate(candidates)}
+    claimed = sorted(response.data or [], key=lambda asset: position.get(str(asset["id"]), len(position)))
     
-    if output_url:
-        update_data["output_url"] = output_url
-        update_data["completed_at"] = "now()"
+    if claimed:
+        print(f"Claimed {len(claimed)} pending assets")
     
-    supabase.table("assets").update(update_data).eq("id", asset_id).execute()
-    print(f"Updated asset {asset_id} status to {status}")
+    return claimed
 
-def extract_text_from_document(document_url: str) -> str:
-    """Extract text content from a document URL."""
-    # In a real implementation, this would handle different document types
-    # For now, we'll simulate downloading and extracting text
-    print(f"Extracting text from {document_url}")
+def renew_leases(asset_ids: List[str], worker_id: str = WORKER_ID, lease_seconds: int = LEASE_SECONDS) -> List[str]:
+    """Extend the lease on assets this worker still holds and return their IDs."""
+    if not asset_ids:
+        return []
     
-    # Simulate document processing time
-    time.sleep(2)
+    response = supabase.rpc("renew_leases", {
+        "worker": worker_id,
+        "ids": asset_ids,
+        "lease_seconds": lease_seconds
+    }).execute()
+    renewed = [str(asset_id) for asset_id in response.data or []]
     
-    # Return placeholder text for demonstration
-    return """
+    for asset_id in set(asset_ids) - set(renewed):
+        print(f"Lost lease on asset {asset_id}")
+    
+    return renewed
+
+def release_claims(asset_ids: List[str], worker_id: str = WORKER_ID) -> None:
+    """Hand back claimed assets this worker will not process, so other workers can claim them right away."""
+    if not asset_ids:
+        return
+    
+    (
+        supabase.table("assets")
+        .update({"claimed_by": None, "lease_expires_at": None})
+        .in_("id", asset_ids)
+        .eq("claimed_by", worker_id)
+        .execute()
+    )
+    print(f"Released {len(asset_ids)} claimed assets")
+
+class LeaseHeartbeat:
+    """Background thread that renews the leases of the assets a worker is processing."""
+
+    def __init__(self, get_asset_ids, worker_id: str = WORKER_ID, lease_seconds: int = LEASE_SECONDS):
+        self.get_asset_ids = get_asset_ids
+        self.worker_id = worker_id
+        self.lease_seconds = lease_seconds
+        self.interval = lease_seconds / 3
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="lease-heartbeat", daemon=True)
+
+    def start(self) -> "LeaseHeartbeat":
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            try:
+                renew_leases(self.get_asset_ids(), self.worker_id, self.lease_seconds)
+            except Exception as e:
+                print(f"Error renewing leases: {str(e)}")
+
+# Status writes. Status changes are buffered by a write-behind StatusSink and
+# committed in bulk through the complete_assets database function, either once
+# STATUS_FLUSH_SIZE changes are waiting or every STATUS_FLUSH_INTERVAL_SECONDS.
+# Repeated updates to the same asset are coalesced, and all requests reuse the
+# Supabase client's pooled keep-alive connection. Pending changes are flushed on
+# shutdown.
+STATUS_FLUSH_SIZE = int(os.getenv("STATUS_FLUSH_SIZE", "50"))
+STATUS_FLUSH_INTERVAL_SECONDS = float(os.getenv("STATUS_FLUSH_INTERVAL_SECONDS", "1"))
+
+class StatusSink:
+    """Write-behind buffer of asset status changes, flushed in bulk."""
+
+    def __init__(self, flush_size: int = STATUS_FLUSH_SIZE, flush_interval: float = STATUS_FLUSH_INTERVAL_SECONDS):
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self.flushes = 0
+        # Pending changes keyed by (worker ID, asset ID); later changes replace earlier ones
+        self._pending: "OrderedDict[Tuple[str, str], Dict[str, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        # Serializes flushes so a change re-queued after a failure is never overtaken
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._commit_callbacks: List[Callable[[Dict[str, Any]], None]] = []
+
+    def on_commit(self, callback: Callable[[Dict[str, Any]], None]) -> None:
+        """Call `callback` with each update once the database has confirmed it."""
+        self._commit_callbacks.append(callback)
+
+    def start(self) -> "StatusSink":
+        """Start the background flusher if it is not running yet."""
+        with self._lock:
+            if self._thread is None:
+                self._stopped.clear()
+                self._thread = threading.Thread(target=self._run, name="status-sink", daemon=True)
+                self._thread.start()
+        return self
+
+    def record(self, asset_id: str, status: str, output_url: Optional[str] = None, worker_id: str = WORKER_ID,
+               retry_in: Optional[float] = None) -> None:
+        """Queue a status change for an asset, or with `retry_in` re-queue it for a later attempt."""
+        self.start()
+        with self._lock:
+            key = (worker_id, asset_id)
+            update = self._pending.pop(key, {"id": asset_id, "output_url": None})
+            update["status"] = status
+            update["retry_in"] = retry_in
+            if output_url:
+                update["output_url"] = output_url
+            self._pending[key] = update
+            full = len(self._pending) >= self.flush_size
+        
+        if full:
+            self._wakeup.set()
+
+    def pending(self) -> int:
+        """Number of status changes waiting to be written."""
+        with self._lock:
+            return len(self._pending)
+
+    def _run(self) -> None:
+        while not self._stopped.is_set():
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"Error flushing status updates: {str(e)}")
+
+    def flush(self) -> None:
+        """Write all pending status changes, one bulk request per worker."""
+        with self._flush_lock:
+            with self._lock:
+                batch = self._pending
+                self._pending = OrderedDict()
+            
+            if not batch:
+                return
+            
+            by_worker: Dict[str, List[Dict[str, Any]]] = {}
+            for (worker_id, _), update in batch.items():
+                by_worker.setdefault(worker_id, []).append(update)
+            
+            for worker_id, updates in by_worker.items():
+                try:
+                    with metrics.timed("status_write", "all"):
+                        response = supabase.rpc("complete_assets", {"updates": updates, "worker": worker_id}).execute()
+                except Exception:
+                    # Put the changes back unless the asset has been updated again since
+                    with self._lock:
+                        for update in updates:
+                            self._pending.setdefault((worker_id, update["id"]), update)
+                    raise
+                
+                self.flushes += 1
+                written = {str(asset_id) for asset_id in response.data or []}
+                for update in updates:
+                    if str(update["id"]) in written:
+                        if update["retry_in"] is not None:
+                            print(f"Requeued asset {update['id']} for retry in {update['retry_in']:.0f}s")
+                        else:
+                            print(f"Updated asset {update['id']} status to {update['status']}")
+                        for callback in self._commit_callbacks:
+                            callback(update)
+                    else:
+                        # Only the current lease holder may finish an asset; if our lease
+                        # expired and another worker reclaimed it, its result was left alone
+                        print(f"Skipped status update for asset {update['id']}: lease held by another worker")
+
+    def close(self) -> None:
+        """Stop the background flusher and write everything still pending."""
+        with self._lock:
+            thread = self._thread
+            self._thread = None
+        
+        if thread is not None:
+            self._stopped.set()
+            self._wakeup.set()
+            thread.join()
+        
+        self.flush()
+
+status_sink = StatusSink()
+atexit.register(status_sink.close)
+
+def update_asset_status(asset_id: str, status: str, output_url: Optional[str] = None, worker_id: str = WORKER_ID,
+                        retry_in: Optional[float] = None) -> None:
+    """Update the status of an asset and release this worker's claim on it (written behind)."""
+    status_sink.record(asset_id, status, output_url, worker_id, retry_in)
+
+# Checkpoints and retries. The result of each processing stage is saved per
+# asset under CHECKPOINT_DIR, so an asset retried after an error, or reclaimed
+# after its worker crashed, resumes from the last completed stage. Stages
+# checkpoint small results: extraction saves the content hash of the document,
+# whose text is then read back from the extraction cache, and generation saves
+# the output URL; the outline is cheap to rebuild from the cached text. Put
+# CHECKPOINT_DIR on a shared volume for workers on other hosts to resume each
+# other's assets. An asset's checkpoints are cleared once its final status has
+# been committed. A failed asset is re-queued with exponential backoff, up to
+# ASSET_MAX_ATTEMPTS attempts in total, before it is marked failed.
+CHECKPOINT_DIR = os.getenv("CHECKPOINT_DIR", os.path.join(tempfile.gettempdir(), "tome-checkpoints"))
+ASSET_MAX_ATTEMPTS = int(os.getenv("ASSET_MAX_ATTEMPTS", "3"))
+ASSET_RETRY_BASE_SECONDS = float(os.getenv("ASSET_RETRY_BASE_SECONDS", "30"))
+ASSET_RETRY_MAX_SECONDS = float(os.getenv("ASSET_RETRY_MAX_SECONDS", "600"))
+
+class CheckpointStore:
+    """On-disk record of the stages each asset has completed."""
+
+    def __init__(self, directory: str = CHECKPOINT_DIR):
+        self.directory = directory
+        self.resumed = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, asset_id: str, stage: str) -> str:
+        return os.path.join(self.directory, str(asset_id), f"{stage}.json")
+
+    def load(self, asset_id: str, stage: str) -> Optional[Any]:
+        """Return the saved result of a stage, or None if it has not completed."""
+        try:
+            with open(self._path(asset_id, stage), "r", encoding="utf-8") as f:
+                return json.load(f)["result"]
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def save(self, asset_id: str, stage: str, result: Any) -> None:
+        path = self._path(asset_id, stage)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump({"result": result, "saved_at": utc_timestamp()}, f)
+        os.replace(temp_path, path)
+
+    def clear(self, asset_id: str) -> None:
+        """Forget an asset's checkpoints once it has completed or finally failed."""
+        shutil.rmtree(os.path.join(self.directory, str(asset_id)), ignore_errors=True)
+
+    def run(self, asset_ids: List[str], stage: str, compute: Callable[[], Any]) -> Any:
+        """Return a stage's checkpointed result for any of the assets, or compute and checkpoint it for all of them."""
+        for asset_id in asset_ids:
+            result = self.load(asset_id, stage)
+            if result is not None:
+                self.resumed += 1
+                print(f"Resuming asset {asset_id} after completed {stage} stage")
+                return result
+        
+        result = compute()
+        for asset_id in asset_ids:
+            self.save(asset_id, stage, result)
+        return result
+
+checkpoint_store = CheckpointStore()
+
+def clear_finished_checkpoints(update: Dict[str, Any]) -> None:
+    # Until the final status is committed, a worker that reclaims the asset
+    # still needs its checkpoints
+    if update["retry_in"] is None:
+        checkpoint_store.clear(update["id"])
+
+status_sink.on_commit(clear_finished_checkpoints)
+
+def retry_delay(attempt: int) -> float:
+    """Backoff before the next attempt, doubling per attempt up to ASSET_RETRY_MAX_SECONDS."""
+    return min(ASSET_RETRY_MAX_SECONDS, ASSET_RETRY_BASE_SECONDS * 2 ** (attempt - 1))
+
+def retry_or_fail(asset: Dict[str, Any], error: Exception) -> None:
+    """Re-queue an asset whose processing failed, or mark it failed once its attempts are used up."""
+    attempt = (asset.get("attempts") or 0) + 1
+    if attempt >= ASSET_MAX_ATTEMPTS:
+        print(f"Giving up on asset {asset['id']} after {attempt} attempts: {str(error)}")
+        metrics.increment("tome_assets_processed_total", asset_type=asset.get("asset_type"), outcome="failed")
+        update_asset_status(asset["id"], "failed")
+        return
+    
+    metrics.increment("tome_assets_processed_total", asset_type=asset.get("asset_type"), outcome="retried")
+    update_asset_status(asset["id"], "processing", retry_in=retry_delay(attempt))
+
+# Document download and extraction. Documents are streamed to a temporary file
+# in DOWNLOAD_CHUNK_BYTES chunks and their text is extracted page by page and
+# split into sections as it streams, so the worker never holds the raw download
+# or a copy of the whole text; what it keeps is the section outline the asset
+# generators work from. While SIMULATE_PROCESSING is on, downloads return the
+# placeholder document below.
+SIMULATE_PROCESSING = os.getenv("SIMULATE_PROCESSING", "true").lower() == "true"
+# Scales the time spent on simulated work (downloads, rendering, LLM calls), e.g. for benchmarks
+SIMULATED_WORK_SCALE = float(os.getenv("SIMULATED_WORK_SCALE", "1"))
+DOWNLOAD_CHUNK_BYTES = int(os.getenv("DOWNLOAD_CHUNK_BYTES", str(1024 * 1024)))
+DOWNLOAD_SPOOL_BYTES = int(os.getenv("DOWNLOAD_SPOOL_BYTES", str(8 * 1024 * 1024)))
+DOWNLOAD_TIMEOUT_SECONDS = int(os.getenv("DOWNLOAD_TIMEOUT_SECONDS", "60"))
+TEXT_PAGE_CHARS = 64 * 1024
+
+def simulate_work(seconds: float) -> None:
+    """Stand in for work that is not implemented yet by sleeping."""
+    time.sleep(seconds * SIMULATED_WORK_SCALE)
+
+# Placeholder document returned by the simulated download
+PLACEHOLDER_DOCUMENT = """
     Standard Operating Procedure: Customer Onboarding Process
     
     1. Introduction
@@ -98,55 +728,1084 @@ def extract_text_from_document(document_url: str) -> str:
     All customer data must be handled according to our data protection policy and relevant regulations.
     """
 
-def process_elearning(asset: Dict[str, Any], document_text: str) -> str:
-    """Process document into an e-learning module."""
-    print(f"Processing e-learning module for asset {asset['id']}")
+# Extracted text cache. Text is keyed by the SHA-256 of the document content,
+# so every asset ordered from the same SOP (and any re-submission of it) only
+# parses the document once. Recently used entries are kept in memory and all
+# entries are persisted on disk, evicting the least recently used files once
+# the directory grows past EXTRACTION_CACHE_MAX_BYTES.
+EXTRACTION_CACHE_DIR = os.getenv("EXTRACTION_CACHE_DIR", os.path.join(tempfile.gettempdir(), "tome-extraction-cache"))
+EXTRACTION_CACHE_MEMORY_ENTRIES = int(os.getenv("EXTRACTION_CACHE_MEMORY_ENTRIES", "64"))
+EXTRACTION_CACHE_MAX_BYTES = int(os.getenv("EXTRACTION_CACHE_MAX_BYTES", str(512 * 1024 * 1024)))
+
+class TextCache:
+    """Two-tier (memory LRU + disk) cache of text keyed by a hash."""
+
+    def __init__(self, directory: str, memory_entries: int, max_disk_bytes: int, memory_max_entry_chars: int = 1024 * 1024):
+        self.directory = directory
+        self.memory_entries = memory_entries
+        self.max_disk_bytes = max_disk_bytes
+        # Larger entries are only kept on disk and streamed back from there
+        self.memory_max_entry_chars = memory_max_entry_chars
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._memory: "OrderedDict[str, str]" = OrderedDict()
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self._disk_bytes = sum(os.path.getsize(path) for path in self._disk_files())
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.txt")
+
+    def _disk_files(self) -> List[str]:
+        return [os.path.join(self.directory, name) for name in os.listdir(self.directory) if name.endswith(".txt")]
+
+    def _remember(self, key: str, text: str) -> None:
+        if len(text) > self.memory_max_entry_chars:
+            return
+        self._memory[key] = text
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
+
+    def _open(self, key: str) -> Tuple[Optional[str], Optional[Iterator[str]]]:
+        """Return the tier an entry was found in and an iterator over its text, without counting the request."""
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                return "memory", iter([self._memory[key]])
+            
+            path = self._path(key)
+            try:
+                # Open eagerly so a concurrent eviction cannot remove the entry under us
+                entry = open(path, "r", encoding="utf-8")
+            except FileNotFoundError:
+                return None, None
+            
+            # Touch the file so disk eviction sees it as recently used
+            os.utime(path)
+        
+        def read_entry() -> Iterator[str]:
+            with entry:
+                while True:
+                    lines = entry.readlines(TEXT_PAGE_CHARS)
+                    if not lines:
+                        break
+                    yield "".join(lines)
+        
+        return "disk", read_entry()
+
+    def _count(self, tier: Optional[str]) -> None:
+        with self._lock:
+            if tier == "memory":
+                self.memory_hits += 1
+            elif tier == "disk":
+                self.disk_hits += 1
+            else:
+                self.misses += 1
+
+    def iter_entry(self, key: str, count: bool = True) -> Optional[Iterator[str]]:
+        """Return an iterator over the cached text for a hash, or None on a miss."""
+        tier, entry = self._open(key)
+        if count:
+            self._count(tier)
+        return entry
+
+    def contains(self, key: str) -> bool:
+        """Whether text is cached for a hash, counted as a cache request."""
+        with self._lock:
+            tier = "memory" if key in self._memory else "disk" if os.path.exists(self._path(key)) else None
+        self._count(tier)
+        return tier is not None
+
+    def get(self, key: str, is_valid: Optional[Callable[[str], bool]] = None, count: bool = True) -> Optional[str]:
+        """Return the cached text for a hash, or None on a miss.
+        
+        An entry rejected by `is_valid` (e.g. one that has expired) is counted
+        as a miss.
+        """
+        tier, entry = self._open(key)
+        text = "".join(entry) if entry is not None else None
+        if text is not None and is_valid is not None and not is_valid(text):
+            tier, text = None, None
+        
+        if count:
+            self._count(tier)
+        if text is not None:
+            with self._lock:
+                self._remember(key, text)
+        return text
+
+    def store_stream(self, key: str, chunks: Iterable[str]) -> Iterator[str]:
+        """Pass text chunks through while writing them to the cache.
+        
+        The entry is only committed once the chunks are exhausted, so an
+        abandoned or failed extraction never leaves a partial entry behind.
+        """
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        memory_chunks: Optional[List[str]] = []
+        memory_chars = 0
+        completed = False
+        
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                for chunk in chunks:
+                    f.write(chunk)
+                    if memory_chunks is not None:
+                        memory_chars += len(chunk)
+                        if memory_chars <= self.memory_max_entry_chars:
+                            memory_chunks.append(chunk)
+                        else:
+                            memory_chunks = None
+                    yield chunk
+            completed = True
+        finally:
+            if not completed:
+                os.remove(tmp_path)
+        
+        with self._lock:
+            if memory_chunks is not None:
+                self._remember(key, "".join(memory_chunks))
+            
+            path = self._path(key)
+            if os.path.exists(path):
+                os.remove(tmp_path)
+                return
+            
+            # Rename into place so readers never see a partial entry
+            os.replace(tmp_path, path)
+            self._disk_bytes += os.path.getsize(path)
+            
+            if self._disk_bytes > self.max_disk_bytes:
+                self._evict()
+
+    def put(self, key: str, text: str) -> None:
+        """Store text under its hash."""
+        for _ in self.store_stream(key, [text]):
+            pass
+
+    def replace(self, key: str, text: str) -> None:
+        """Store text under a key, overwriting any existing entry."""
+        with self._lock:
+            self._memory.pop(key, None)
+            path = self._path(key)
+            if os.path.exists(path):
+                self._disk_bytes -= os.path.getsize(path)
+                os.remove(path)
+        self.put(key, text)
+
+    def _evict(self) -> None:
+        """Delete least recently used files until the disk tier is back under its budget."""
+        for path in sorted(self._disk_files(), key=os.path.getmtime):
+            if self._disk_bytes <= self.max_disk_bytes:
+                break
+            size = os.path.getsize(path)
+            os.remove(path)
+            self._disk_bytes -= size
+            self.evictions += 1
+
+    def stats(self) -> Dict[str, int]:
+        """Hit/miss counters and current tier sizes."""
+        with self._lock:
+            return {
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "memory_entries": len(self._memory),
+                "disk_bytes": self._disk_bytes
+            }
+
+extraction_cache = TextCache(EXTRACTION_CACHE_DIR, EXTRACTION_CACHE_MEMORY_ENTRIES, EXTRACTION_CACHE_MAX_BYTES)
+
+def download_document(document_url: str) -> Tuple[IO[bytes], str]:
+    """Stream the original document into a temporary file.
     
-    # In a real implementation, this would call OpenAI API to generate content
-    # and create SCORM package or other e-learning format
+    Returns the file, positioned at the start, and the SHA-256 of its content.
+    Small documents stay in memory; anything over DOWNLOAD_SPOOL_BYTES is
+    spilled to disk, so memory use does not grow with document size.
+    """
+    print(f"Downloading document from {document_url}")
+    document_file = tempfile.SpooledTemporaryFile(max_size=DOWNLOAD_SPOOL_BYTES)
+    digest = hashlib.sha256()
     
-    # Simulate OpenAI API call
-    prompt = f"""
-    Transform the following SOP into an engaging e-learning module outline.
-    Target audience: {asset.get('audience', 'General employees')}
-    Tone: {asset.get('tone', 'Professional')}
-    Must include compliance text: {asset.get('compliance_text', 'N/A')}
+    try:
+        if SIMULATE_PROCESSING:
+            # Simulate download time and return placeholder content for demonstration
+            simulate_work(0.5)
+            content = PLACEHOLDER_DOCUMENT.encode("utf-8")
+            digest.update(content)
+            document_file.write(content)
+        else:
+            import requests
+            with requests.get(document_url, stream=True, timeout=DOWNLOAD_TIMEOUT_SECONDS) as response:
+                response.raise_for_status()
+                for chunk in response.iter_content(chunk_size=DOWNLOAD_CHUNK_BYTES):
+                    digest.update(chunk)
+                    document_file.write(chunk)
+    except Exception:
+        document_file.close()
+        raise
+    
+    document_file.seek(0)
+    return document_file, digest.hexdigest()
+
+def iter_document_pages(document_file: IO[bytes]) -> Iterator[str]:
+    """Extract text from a downloaded document one page at a time."""
+    if SIMULATE_PROCESSING:
+        # Simulate document processing time
+        simulate_work(1.5)
+    
+    header = document_file.read(5)
+    document_file.seek(0)
+    
+    if header == b"%PDF-":
+        # Only PDF uploads need a PDF parser
+        from pypdf import PdfReader
+        
+        # PdfReader parses pages lazily, so only one page's text is held at a time
+        for page in PdfReader(document_file).pages:
+            text = page.extract_text() or ""
+            yield text if text.endswith("\n") else text + "\n"
+        return
+    
+    # Plain text documents are read in whole-line blocks of roughly a page
+    text_file = io.TextIOWrapper(document_file, encoding="utf-8", errors="replace")
+    try:
+        while True:
+            lines = text_file.readlines(TEXT_PAGE_CHARS)
+            if not lines:
+                break
+            yield "".join(lines)
+    finally:
+        # Leave the underlying file for the caller to close
+        text_file.detach()
+
+def iter_document_text(document_url: str) -> Iterator[str]:
+    """Stream the text of a document page by page, reusing earlier extractions of the same content."""
+    document_file, content_hash = download_document(document_url)
     
-    SOP:
-    {document_text}
+    with document_file:
+        cached = extraction_cache.iter_entry(content_hash)
+        if cached is not None:
+            print(f"Using cached text for {document_url}")
+            yield from cached
+            return
+        
+        print(f"Extracting text from {document_url}")
+        yield from extraction_cache.store_stream(content_hash, iter_document_pages(document_file))
+
+SECTION_HEADING = re.compile(r"^(\d+(?:\.\d+)*)\.?\s+(\S.*)$")
+
+def iter_sections(pages: Iterable[str]) -> Iterator[Dict[str, Any]]:
+    """Split streamed document text into numbered sections as it arrives.
     
-    Create a structured e-learning module with:
-    1. Learning objectives
-    2. Module sections with interactive elements
-    3. Knowledge check questions
-    4. Summary and next steps
+    Lines before the first numbered heading are yielded as a level 0 preamble
+    section. Only the section currently being read is held in memory.
     """
+    section: Dict[str, Any] = {"number": "", "title": "", "level": 0, "lines": []}
+    partial = ""
     
-    # Simulate processing time
-    time.sleep(5)
+    def split_lines(pages: Iterable[str]) -> Iterator[str]:
+        nonlocal partial
+        for page in pages:
+            lines = (partial + page).split("\n")
+            partial = lines.pop()
+            yield from lines
+        if partial:
+            yield partial
     
-    # Generate a filename for the output
-    filename = f"elearning_{asset['id']}.html"
+    for line in split_lines(pages):
+        line = line.strip()
+        if not line:
+            continue
+        
+        heading = SECTION_HEADING.match(line)
+        if heading:
+            if section["level"] or section["lines"]:
+                yield section
+            number, title = heading.groups()
+            section = {"number": number, "title": title, "level": number.count(".") + 1, "lines": []}
+        else:
+            section["lines"].append(line)
+    
+    if section["level"] or section["lines"]:
+        yield section
+
+def extract_document(document_url: str) -> str:
+    """Download a document and extract its text into the extraction cache, returning its content hash."""
+    document_file, content_hash = download_document(document_url)
+    
+    with document_file:
+        if extraction_cache.contains(content_hash):
+            print(f"Using cached text for {document_url}")
+            return content_hash
+        
+        print(f"Extracting text from {document_url}")
+        for _ in extraction_cache.store_stream(content_hash, iter_document_pages(document_file)):
+            pass
+    
+    return content_hash
+
+def iter_document_sections(document_url: str, content_hash: Optional[str] = None) -> Iterator[Dict[str, Any]]:
+    """Stream the sections of a document without holding the whole document in memory.
+    
+    With the `content_hash` returned by extract_document, the text is read back
+    from the extraction cache; the document is only downloaded again if the
+    entry has been evicted or was cached on another host.
+    """
+    cached = extraction_cache.iter_entry(content_hash, count=False) if content_hash else None
+    return iter_sections(cached if cached is not None else iter_document_text(document_url))
+
+def build_section_outline(document_text: Any) -> Dict[str, Any]:
+    """Collect an SOP's title and numbered sections from its text or an iterator of sections."""
+    sections = iter_sections([document_text]) if isinstance(document_text, str) else document_text
+    
+    title = ""
+    outline_sections: List[Dict[str, Any]] = []
+    for section in sections:
+        if section["level"]:
+            outline_sections.append(section)
+        elif section["lines"] and not title:
+            # "Standard Operating Procedure: Customer Onboarding Process" -> "Customer Onboarding Process"
+            title = section["lines"][0].split(": ", 1)[-1]
+    
+    return {"title": title, "sections": outline_sections}
+
+# LLM completion cache. Completions are keyed by the normalized prompt together
+# with the model and request parameters, so retries, re-runs and duplicate
+# orders with the same settings reuse an earlier answer until it is older than
+# COMPLETION_CACHE_TTL_SECONDS. Concurrent identical requests share a single
+# upstream call.
+OPENAI_MODEL = os.getenv("OPENAI_MODEL", "gpt-4o")
+COMPLETION_CACHE_DIR = os.getenv("COMPLETION_CACHE_DIR", os.path.join(tempfile.gettempdir(), "tome-completion-cache"))
+COMPLETION_CACHE_MEMORY_ENTRIES = int(os.getenv("COMPLETION_CACHE_MEMORY_ENTRIES", "1024"))
+COMPLETION_CACHE_MAX_BYTES = int(os.getenv("COMPLETION_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+COMPLETION_CACHE_TTL_SECONDS = int(os.getenv("COMPLETION_CACHE_TTL_SECONDS", str(7 * 24 * 60 * 60)))
+
+def normalize_prompt(prompt: str) -> str:
+    """Canonicalize whitespace so prompts that differ only in indentation or spacing share a cache key."""
+    lines = [" ".join(line.split()) for line in prompt.strip().splitlines()]
+    return re.sub(r"\n{3,}", "\n\n", "\n".join(lines))
+
+class CompletionCache:
+    """TTL cache of LLM completions on top of a TextCache, with in-flight request deduplication."""
+
+    def __init__(self, store: TextCache, ttl_seconds: int = COMPLETION_CACHE_TTL_SECONDS):
+        self.store = store
+        self.ttl_seconds = ttl_seconds
+        self.shared_requests = 0
+        self._in_flight: Dict[str, Future] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(prompt: str, model: str, params: Dict[str, Any]) -> str:
+        payload = json.dumps([normalize_prompt(prompt), model, params], sort_keys=True)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def _fresh(cached: str) -> bool:
+        return json.loads(cached)["expires_at"] >= time.time()
+
+    def _lookup(self, key: str, count: bool = True) -> Optional[str]:
+        cached = self.store.get(key, self._fresh, count)
+        return json.loads(cached)["completion"] if cached is not None else None
+
+    def get_or_create(self, key: str, create: Callable[[], str]) -> str:
+        """Return the cached completion for a key, calling `create` at most once across concurrent callers."""
+        completion = self._lookup(key)
+        if completion is not None:
+            return completion
+        
+        with self._lock:
+            future = self._in_flight.get(key)
+            owner = future is None
+            if owner:
+                future = Future()
+                self._in_flight[key] = future
+            else:
+                self.shared_requests += 1
+        
+        if not owner:
+            return future.result()
+        
+        try:
+            # Another owner may have stored the completion between our lookup
+            # and registering ours; that request was served without a call too
+            completion = self._lookup(key, count=False)
+            if completion is not None:
+                with self._lock:
+                    self.shared_requests += 1
+                future.set_result(completion)
+                return completion
+            
+            completion = create()
+            entry = {"completion": completion, "expires_at": time.time() + self.ttl_seconds}
+            self.store.replace(key, json.dumps(entry))
+            future.set_result(completion)
+            return completion
+        except Exception as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                del self._in_flight[key]
+
+    def stats(self) -> Dict[str, int]:
+        """Counters of the underlying store plus requests served by an in-flight call."""
+        return dict(self.store.stats(), shared_requests=self.shared_requests)
+
+completion_cache = CompletionCache(TextCache(COMPLETION_CACHE_DIR, COMPLETION_CACHE_MEMORY_ENTRIES, COMPLETION_CACHE_MAX_BYTES))
+
+# OpenAI rate limiting. Every OpenAI call takes a slot from OpenAIRateLimiter,
+# which enforces the account's request and token budgets with token buckets and
+# adapts the number of concurrent calls AIMD-style: it grows slowly while calls
+# succeed and halves on 429s and timeouts. The limiter state lives in a locked
+# file, so every worker process on a host shares the same budget. Rate limited
+# calls are retried with backoff instead of failing the asset.
+OPENAI_REQUESTS_PER_MINUTE = int(os.getenv("OPENAI_REQUESTS_PER_MINUTE", "500"))
+OPENAI_TOKENS_PER_MINUTE = int(os.getenv("OPENAI_TOKENS_PER_MINUTE", "200000"))
+OPENAI_MAX_CONCURRENCY = int(os.getenv("OPENAI_MAX_CONCURRENCY", "16"))
+OPENAI_MAX_RETRIES = int(os.getenv("OPENAI_MAX_RETRIES", "6"))
+OPENAI_RATE_LIMIT_STATE = os.getenv("OPENAI_RATE_LIMIT_STATE", os.path.join(tempfile.gettempdir(), "tome-openai-limiter.json"))
+
+class RateLimitedError(Exception):
+    """An OpenAI call was rejected for rate limiting and its retries ran out."""
+
+def is_rate_limit_error(error: Exception) -> bool:
+    """True for errors that mean "slow down": HTTP 429s and timeouts."""
+    if getattr(error, "status_code", None) == 429 or isinstance(error, TimeoutError):
+        return True
+    # Only look at the openai error types if the library was loaded to make the call
+    openai = sys.modules.get("openai")
+    retryable = (getattr(openai, "RateLimitError", ()), getattr(openai, "APITimeoutError", ()))
+    return isinstance(error, retryable)
+
+def retry_after_seconds(error: Exception) -> Optional[float]:
+    """Read the Retry-After header from a rate limit error, if the server sent one."""
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None) or {}
+    try:
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+class OpenAIRateLimiter:
+    """Request/token buckets plus an adaptive concurrency limit, shared across threads and processes."""
+
+    def __init__(self, requests_per_minute: int = OPENAI_REQUESTS_PER_MINUTE, tokens_per_minute: int = OPENAI_TOKENS_PER_MINUTE,
+                 max_concurrency: int = OPENAI_MAX_CONCURRENCY, state_path: Optional[str] = OPENAI_RATE_LIMIT_STATE,
+                 min_concurrency: int = 1):
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.max_concurrency = max_concurrency
+        self.min_concurrency = min_concurrency
+        self.state_path = state_path
+        self._lock = threading.Lock()
+        self._state: Dict[str, Any] = {}
+
+    def _initial_state(self) -> Dict[str, Any]:
+        return {
+            "requests": float(self.requests_per_minute),
+            "tokens": float(self.tokens_per_minute),
+            "refilled_at": time.time(),
+            "concurrency_limit": float(self.max_concurrency),
+            "blocked_until": 0.0,
+            "in_flight": {}
+        }
+
+    @contextmanager
+    def _transaction(self):
+        """Lock the shared state, refill the buckets and yield it for modification."""
+        with self._lock:
+            if self.state_path is None:
+                state = self._state or self._initial_state()
+                self._refill(state)
+                yield state
+                self._state = state
+                return
+            
+            # The state file is replaced rather than rewritten, so a process killed
+            # mid-write never leaves a partial file; the flock is held on a
+            # separate lock file that is never replaced
+            with open(f"{self.state_path}.lock", "a") as lock:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+                try:
+                    state = self._load()
+                    self._refill(state)
+                    self._reap(state)
+                    yield state
+                    temp_path = f"{self.state_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+                    with open(temp_path, "w") as f:
+                        json.dump(state, f)
+                    os.replace(temp_path, self.state_path)
+                finally:
+                    fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _load(self) -> Dict[str, Any]:
+        """Read the shared state, starting over if the file is missing or unreadable."""
+        initial = self._initial_state()
+        try:
+            with open(self.state_path, "r") as f:
+                state = json.load(f)
+        except FileNotFoundError:
+            return initial
+        except (OSError, ValueError) as e:
+            print(f"Resetting unreadable OpenAI rate limit state: {str(e)}")
+            return initial
+        if not isinstance(state, dict) or any(key not in state for key in initial):
+            print("Resetting incomplete OpenAI rate limit state")
+            return initial
+        return state
+
+    def _refill(self, state: Dict[str, Any]) -> None:
+        now = time.time()
+        elapsed = max(0.0, now - state["refilled_at"])
+        state["requests"] = min(float(self.requests_per_minute), state["requests"] + elapsed * self.requests_per_minute / 60)
+        state["tokens"] = min(float(self.tokens_per_minute), state["tokens"] + elapsed * self.tokens_per_minute / 60)
+        state["refilled_at"] = now
+
+    def _reap(self, state: Dict[str, Any]) -> None:
+        """Forget in-flight calls of processes that have exited."""
+        for pid in list(state["in_flight"]):
+            try:
+                os.kill(int(pid), 0)
+            except ProcessLookupError:
+                del state["in_flight"][pid]
+            except PermissionError:
+                pass
+
+    def _try_acquire(self, estimated_tokens: int) -> float:
+        """Take a slot if one is available; otherwise return how long to wait before trying again."""
+        with self._transaction() as state:
+            now = time.time()
+            if state["blocked_until"] > now:
+                return state["blocked_until"] - now
+            
+            in_flight = sum(state["in_flight"].values())
+            if in_flight >= int(state["concurrency_limit"]):
+                return 0.05
+            
+            # A single call larger than the whole budget is let through once the bucket is full
+            estimated_tokens = min(estimated_tokens, self.tokens_per_minute)
+            if state["requests"] < 1:
+                return (1 - state["requests"]) * 60 / self.requests_per_minute
+            if state["tokens"] < estimated_tokens:
+                return (estimated_tokens - state["tokens"]) * 60 / self.tokens_per_minute
+            
+            state["requests"] -= 1
+            state["tokens"] -= estimated_tokens
+            pid = str(os.getpid())
+            state["in_flight"][pid] = state["in_flight"].get(pid, 0) + 1
+            return 0.0
+
+    def acquire(self, estimated_tokens: int) -> None:
+        """Block until the budgets and the concurrency limit allow another call."""
+        while True:
+            delay = self._try_acquire(estimated_tokens)
+            if delay <= 0:
+                return
+            time.sleep(min(delay, 1.0))
+
+    def release(self, rate_limited: bool = False, retry_after: Optional[float] = None,
+                estimated_tokens: int = 0, used_tokens: Optional[int] = None) -> None:
+        """Return a slot and adapt the concurrency limit to how the call went."""
+        with self._transaction() as state:
+            pid = str(os.getpid())
+            state["in_flight"][pid] = max(0, state["in_flight"].get(pid, 0) - 1)
+            if not state["in_flight"][pid]:
+                del state["in_flight"][pid]
+            
+            # Settle the token estimate against the actual usage
+            if used_tokens is not None:
+                state["tokens"] -= used_tokens - min(estimated_tokens, self.tokens_per_minute)
+            
+            limit = state["concurrency_limit"]
+            if rate_limited:
+                # Multiplicative decrease, and pause everyone for the server-requested time
+                state["concurrency_limit"] = max(float(self.min_concurrency), limit / 2)
+                if retry_after:
+                    state["blocked_until"] = max(state["blocked_until"], time.time() + retry_after)
+            else:
+                # Additive increase: roughly one more slot per limit's worth of successful calls
+                state["concurrency_limit"] = min(float(self.max_concurrency), limit + 1 / limit)
+
+    def concurrency_limit(self) -> int:
+        """The current adaptive concurrency limit."""
+        with self._transaction() as state:
+            return int(state["concurrency_limit"])
+
+    def call(self, function: Callable[[], Any], estimated_tokens: int, max_retries: int = OPENAI_MAX_RETRIES) -> Any:
+        """Run an OpenAI call under the limiter, retrying rate limited attempts with exponential backoff."""
+        for attempt in range(max_retries + 1):
+            self.acquire(estimated_tokens)
+            try:
+                result = function()
+            except Exception as e:
+                if not is_rate_limit_error(e):
+                    self.release(estimated_tokens=estimated_tokens)
+                    raise
+                
+                retry_after = retry_after_seconds(e)
+                self.release(rate_limited=True, retry_after=retry_after, estimated_tokens=estimated_tokens)
+                if attempt == max_retries:
+                    raise RateLimitedError(f"OpenAI call still rate limited after {max_retries} retries") from e
+                
+                # With a Retry-After the next acquire() already waits it out
+                if retry_after is None:
+                    time.sleep(min(60.0, 2 ** attempt) * random.uniform(0.5, 1.0))
+                continue
+            
+            usage = getattr(result, "usage", None)
+            self.release(estimated_tokens=estimated_tokens, used_tokens=getattr(usage, "total_tokens", None))
+            return result
+
+openai_rate_limiter = OpenAIRateLimiter()
+
+def estimate_tokens(prompt: str, max_tokens: int) -> int:
+    """Rough token count of a request: ~4 characters per prompt token plus the completion budget."""
+    return len(prompt) // 4 + max_tokens
+
+def generate_completion(prompt: str, model: str = OPENAI_MODEL, **params: Any) -> str:
+    """Return an LLM completion for a prompt, served from the completion cache when possible."""
+    def create() -> str:
+        with metrics.timed("llm"):
+            return request_completion(prompt, model, **params)
+    
+    return completion_cache.get_or_create(CompletionCache.key(prompt, model, params), create)
+
+def request_completion(prompt: str, model: str, **params: Any) -> str:
+    """Request a completion from OpenAI through the rate limiter."""
+    if SIMULATE_PROCESSING:
+        # Simulate OpenAI API call
+        simulate_work(0.4)
+        return "Review each step below, then practice it in the interactive element."
+    
+    response = openai_rate_limiter.call(
+        lambda: openai_client.chat.completions.create(
+            model=model,
+            messages=[{"role": "user", "content": normalize_prompt(prompt)}],
+            **params
+        ),
+        estimate_tokens(prompt, params.get("max_tokens", 1024))
+    )
+    return response.choices[0].message.content
+
+# Output uploads. Generated outputs are stored content-addressed, under the
+# SHA-256 of their bytes, so an output identical to one uploaded before is not
+# uploaded again. Outputs larger than UPLOAD_PART_BYTES are sent as a multipart
+# upload with up to UPLOAD_CONCURRENCY parts in flight; each part is retried
+# with backoff, and an interrupted upload is resumed from its completed parts
+# the next time the same output is uploaded. OUTPUT_STORAGE selects the
+# backend: "supabase" uses Supabase Storage's S3-compatible endpoint, and
+# "local:<directory>" writes to a local directory (the default when simulating).
+OUTPUT_BUCKET = os.getenv("OUTPUT_BUCKET", "processed-assets")
+OUTPUT_STORAGE = os.getenv(
+    "OUTPUT_STORAGE",
+    f"local:{os.path.join(tempfile.gettempdir(), 'tome-outputs')}" if SIMULATE_PROCESSING else "supabase"
+)
+UPLOAD_PART_BYTES = int(os.getenv("UPLOAD_PART_BYTES", str(8 * 1024 * 1024)))
+UPLOAD_CONCURRENCY = int(os.getenv("UPLOAD_CONCURRENCY", "4"))
+UPLOAD_MAX_RETRIES = int(os.getenv("UPLOAD_MAX_RETRIES", "3"))
+UPLOAD_JOURNAL_DIR = os.getenv("UPLOAD_JOURNAL_DIR", os.path.join(tempfile.gettempdir(), "tome-upload-journal"))
+
+class SupabaseS3Storage:
+    """Output storage on Supabase Storage through its S3-compatible API."""
+
+    def __init__(self, bucket: str = OUTPUT_BUCKET):
+        self.bucket = bucket
+        self._client = None
+        self._lock = threading.Lock()
+
+    def client(self):
+        with self._lock:
+            if self._client is None:
+                # boto3 is only needed by workers that upload to Supabase Storage
+                import boto3
+                self._client = boto3.client(
+                    "s3",
+                    endpoint_url=f"{supabase_url}/storage/v1/s3",
+                    aws_access_key_id=os.getenv("SUPABASE_S3_ACCESS_KEY_ID"),
+                    aws_secret_access_key=os.getenv("SUPABASE_S3_SECRET_ACCESS_KEY"),
+                    region_name=os.getenv("SUPABASE_S3_REGION", "us-east-1")
+                )
+            return self._client
+
+    def exists(self, path: str) -> bool:
+        try:
+            self.client().head_object(Bucket=self.bucket, Key=path)
+            return True
+        except Exception as e:
+            code = getattr(e, "response", {}).get("Error", {}).get("Code")
+            if code in ("404", "NoSuchKey", "NotFound"):
+                return False
+            raise
+
+    def put_object(self, path: str, data: bytes, content_type: str) -> None:
+        self.client().put_object(Bucket=self.bucket, Key=path, Body=data, ContentType=content_type)
+
+    def create_multipart_upload(self, path: str, content_type: str) -> str:
+        return self.client().create_multipart_upload(Bucket=self.bucket, Key=path, ContentType=content_type)["UploadId"]
+
+    def upload_part(self, path: str, upload_id: str, part_number: int, data: bytes) -> str:
+        response = self.client().upload_part(Bucket=self.bucket, Key=path, UploadId=upload_id, PartNumber=part_number, Body=data)
+        return response["ETag"]
+
+    def list_parts(self, path: str, upload_id: str) -> Dict[int, str]:
+        parts: Dict[int, str] = {}
+        marker = 0
+        while True:
+            response = self.client().list_parts(Bucket=self.bucket, Key=path, UploadId=upload_id, PartNumberMarker=marker)
+            for part in response.get("Parts", []):
+                parts[part["PartNumber"]] = part["ETag"]
+            if not response.get("IsTruncated"):
+                return parts
+            marker = response["NextPartNumberMarker"]
+
+    def complete_multipart_upload(self, path: str, upload_id: str, parts: List[Tuple[int, str]]) -> None:
+        self.client().complete_multipart_upload(
+            Bucket=self.bucket,
+            Key=path,
+            UploadId=upload_id,
+            MultipartUpload={"Parts": [{"PartNumber": number, "ETag": etag} for number, etag in parts]}
+        )
+
+    def abort_multipart_upload(self, path: str, upload_id: str) -> None:
+        self.client().abort_multipart_upload(Bucket=self.bucket, Key=path, UploadId=upload_id)
+
+    def public_url(self, path: str) -> str:
+        return f"{supabase_url}/storage/v1/object/public/{self.bucket}/{path}"
+
+class OutputUploader:
+    """Content-addressed, parallel, resumable uploads of generated outputs."""
+
+    def __init__(self, storage: Any, part_bytes: int = UPLOAD_PART_BYTES, concurrency: int = UPLOAD_CONCURRENCY,
+                 max_retries: int = UPLOAD_MAX_RETRIES, journal_dir: str = UPLOAD_JOURNAL_DIR):
+        self.storage = storage
+        self.part_bytes = part_bytes
+        self.concurrency = concurrency
+        self.max_retries = max_retries
+        self.journal_dir = journal_dir
+        self.deduplicated = 0
+        self._executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="upload")
+        # Content hash -> upload in progress; identical outputs uploaded at the
+        # same time wait for the first upload instead of sharing its journal
+        self._in_flight: Dict[str, Future] = {}
+        self._lock = threading.Lock()
+        os.makedirs(journal_dir, exist_ok=True)
+
+    def _spool(self, content: Any) -> Tuple[IO[bytes], str, int]:
+        """Copy the output to a temporary file, hashing it on the way."""
+        chunks = [content] if isinstance(content, (str, bytes)) else content
+        output_file = tempfile.SpooledTemporaryFile(max_size=self.part_bytes)
+        digest = hashlib.sha256()
+        size = 0
+        for chunk in chunks:
+            if isinstance(chunk, str):
+                chunk = chunk.encode("utf-8")
+            digest.update(chunk)
+            output_file.write(chunk)
+            size += len(chunk)
+        output_file.seek(0)
+        return output_file, digest.hexdigest(), size
+
+    def _retry(self, function: Callable, *args) -> Any:
+        for attempt in range(self.max_retries + 1):
+            try:
+                return function(*args)
+            except Exception as e:
+                if attempt == self.max_retries:
+                    raise
+                print(f"Retrying upload request after error: {str(e)}")
+                time.sleep(min(10.0, 0.5 * 2 ** attempt) * random.uniform(0.5, 1.0))
+
+    def _journal_path(self, content_hash: str) -> str:
+        return os.path.join(self.journal_dir, f"{content_hash}.json")
+
+    def _resume_or_start(self, path: str, content_hash: str, content_type: str) -> Tuple[str, Dict[int, str]]:
+        """Resume an interrupted upload of the same content, or start a new one."""
+        try:
+            with open(self._journal_path(content_hash), "r", encoding="utf-8") as f:
+                upload_id = json.load(f)["upload_id"]
+            completed = self._retry(self.storage.list_parts, path, upload_id)
+            print(f"Resuming upload of {path} with {len(completed)} parts already uploaded")
+            return upload_id, completed
+        except Exception:
+            # No journal, or the interrupted upload has expired on the server
+            pass
+        
+        upload_id = self._retry(self.storage.create_multipart_upload, path, content_type)
+        with open(self._journal_path(content_hash), "w", encoding="utf-8") as f:
+            json.dump({"upload_id": upload_id, "path": path}, f)
+        return upload_id, {}
+
+    def _upload_multipart(self, output_file: IO[bytes], path: str, content_hash: str, size: int, content_type: str) -> None:
+        upload_id, completed = self._resume_or_start(path, content_hash, content_type)
+        part_count = (size + self.part_bytes - 1) // self.part_bytes
+        
+        # Parts are read one at a time on this thread; the semaphore bounds how
+        # many are buffered in memory while waiting for an upload slot
+        buffered = threading.BoundedSemaphore(self.concurrency * 2)
+        
+        def send(part_number: int, data: bytes) -> Tuple[int, str]:
+            try:
+                return part_number, self._retry(self.storage.upload_part, path, upload_id, part_number, data)
+            finally:
+                buffered.release()
+        
+        futures = []
+        for part_number in range(1, part_count + 1):
+            if part_number in completed:
+                continue
+            output_file.seek((part_number - 1) * self.part_bytes)
+            data = output_file.read(self.part_bytes)
+            buffered.acquire()
+            futures.append(self._executor.submit(send, part_number, data))
+        
+        # Let every part finish before reporting a failure, so the next attempt
+        # only resends the parts that failed; the journal stays in place for it
+        wait(futures)
+        for future in futures:
+            part_number, etag = future.result()
+            completed[part_number] = etag
+        
+        self._retry(self.storage.complete_multipart_upload, path, upload_id, sorted(completed.items()))
+        try:
+            os.remove(self._journal_path(content_hash))
+        except FileNotFoundError:
+            pass
+
+    def _store(self, output_file: IO[bytes], path: str, content_hash: str, size: int, content_type: str) -> None:
+        if self._retry(self.storage.exists, path):
+            with self._lock:
+                self.deduplicated += 1
+            print(f"Output already stored at {path}, skipping upload")
+            return
+        
+        if size <= self.part_bytes:
+            self._retry(self.storage.put_object, path, output_file.read(), content_type)
+        else:
+            self._upload_multipart(output_file, path, content_hash, size, content_type)
+
+    def upload(self, content: Any, extension: str, content_type: str) -> str:
+        """Upload an output (text, bytes or an iterable of chunks) and return its object path."""
+        output_file, content_hash, size = self._spool(content)
+        path = f"{content_hash[:2]}/{content_hash}{extension}"
+        
+        with output_file:
+            with self._lock:
+                future = self._in_flight.get(content_hash)
+                owner = future is None
+                if owner:
+                    future = Future()
+                    self._in_flight[content_hash] = future
+            
+            if not owner:
+                # The same output is being uploaded by another thread
+                future.result()
+                with self._lock:
+                    self.deduplicated += 1
+                print(f"Output already uploaded to {path} by another thread, skipping upload")
+                return path
+            
+            try:
+                self._store(output_file, path, content_hash, size, content_type)
+                future.set_result(path)
+            except Exception as e:
+                future.set_exception(e)
+                raise
+            finally:
+                with self._lock:
+                    del self._in_flight[content_hash]
+        
+        return path
+
+def create_output_storage(setting: str = OUTPUT_STORAGE) -> Any:
+    """Build the output storage backend selected by OUTPUT_STORAGE."""
+    if setting.startswith("local:"):
+        from local_backends import LocalDirectoryStorage
+        return LocalDirectoryStorage(setting[len("local:"):])
+    return SupabaseS3Storage()
+
+output_uploader = OutputUploader(create_output_storage())
+
+def upload_output(content: Any, extension: str, content_type: str) -> str:
+    """Upload a generated output and return its public URL."""
+    with metrics.timed("upload"):
+        path = output_uploader.upload(content, extension, content_type)
+    return output_uploader.storage.public_url(path)
+
+# Section index for incremental regeneration. When a customer uploads a revised
+# SOP, each section is fingerprinted and compared with the index stored for the
+# previous revision of the same document and asset type; unchanged sections
+# reuse their stored output fragment and only changed sections are regenerated.
+# The least recently used lineages are evicted once the index grows past
+# SECTION_INDEX_MAX_BYTES; the next revision of an evicted lineage is simply
+# regenerated in full.
+SECTION_INDEX_DIR = os.getenv("SECTION_INDEX_DIR", os.path.join(tempfile.gettempdir(), "tome-section-index"))
+SECTION_INDEX_MAX_BYTES = int(os.getenv("SECTION_INDEX_MAX_BYTES", str(256 * 1024 * 1024)))
+
+class SectionIndex:
+    """On-disk store of per-section fingerprints and generated fragments, one file per document lineage."""
+
+    def __init__(self, directory: str = SECTION_INDEX_DIR, max_bytes: int = SECTION_INDEX_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.evictions = 0
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self._bytes = sum(os.path.getsize(path) for path in self._files())
+
+    def _path(self, lineage: str) -> str:
+        return os.path.join(self.directory, f"{lineage}.json")
+
+    def _files(self) -> List[str]:
+        return [os.path.join(self.directory, name) for name in os.listdir(self.directory) if name.endswith(".json")]
+
+    def load(self, lineage: str) -> Dict[str, Dict[str, str]]:
+        """Return the stored sections for a lineage, keyed by section number and title."""
+        with self._lock:
+            path = self._path(lineage)
+            try:
+                f = open(path, "r", encoding="utf-8")
+            except FileNotFoundError:
+                return {}
+            # Touch the file so eviction sees the lineage as recently used
+            os.utime(path)
+        
+        with f:
+            return json.load(f)
+
+    def save(self, lineage: str, sections: Dict[str, Dict[str, str]]) -> None:
+        """Replace the stored sections for a lineage."""
+        with self._lock:
+            path = self._path(lineage)
+            fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump(sections, f)
+            
+            try:
+                self._bytes -= os.path.getsize(path)
+            except FileNotFoundError:
+                pass
+            os.replace(tmp_path, path)
+            self._bytes += os.path.getsize(path)
+            
+            if self._bytes > self.max_bytes:
+                self._evict()
+
+    def _evict(self) -> None:
+        """Delete least recently used lineages until the index is back under its budget."""
+        for path in sorted(self._files(), key=os.path.getmtime):
+            if self._bytes <= self.max_bytes:
+                break
+            size = os.path.getsize(path)
+            os.remove(path)
+            self._bytes -= size
+            self.evictions += 1
+
+section_index = SectionIndex()
+
+def document_lineage(asset: Dict[str, Any]) -> str:
+    """Identify the revisions of one customer document rendered as one asset type."""
+    owner = asset.get("organization_id") or asset.get("user_id") or ""
+    key = json.dumps([owner, asset.get("original_document_name"), asset.get("asset_type")])
+    return hashlib.sha256(key.encode("utf-8")).hexdigest()
+
+def section_fingerprint(asset: Dict[str, Any], section: Dict[str, Any]) -> str:
+    """Hash a section's content together with the settings that shape its generated output."""
+    key = json.dumps([
+        section["number"],
+        section["title"],
+        section["lines"],
+        asset.get("audience"),
+        asset.get("tone"),
+        asset.get("compliance_text")
+    ])
+    return hashlib.sha256(key.encode("utf-8")).hexdigest()
+
+def generate_section_fragments(asset: Dict[str, Any], sections: List[Dict[str, Any]],
+                               render_section: Callable[[Dict[str, Any], Dict[str, Any]], str]) -> List[str]:
+    """Render an output fragment per section, reusing fragments of sections unchanged since the last revision."""
+    lineage = document_lineage(asset)
+    previous = section_index.load(lineage)
+    current: Dict[str, Dict[str, str]] = {}
+    fragments = []
+    regenerated = 0
+    
+    for section in sections:
+        key = f"{section['number']} {section['title']}"
+        fingerprint = section_fingerprint(asset, section)
+        stored = previous.get(key)
+        
+        if stored and stored["fingerprint"] == fingerprint:
+            fragment = stored["fragment"]
+        else:
+            fragment = render_section(asset, section)
+            regenerated += 1
+        
+        current[key] = {"fingerprint": fingerprint, "fragment": fragment}
+        fragments.append(fragment)
     
-    # In a real implementation, this would create and upload the actual file
-    # For now, we'll create a simple HTML file as a placeholder
-    elearning_content = f"""
+    section_index.save(lineage, current)
+    print(f"Regenerated {regenerated} of {len(sections)} sections for asset {asset['id']}")
+    return fragments
+
+# HTML templates for generated assets. Templates are compiled once, at import,
+# into runs of static text and named slots. Rendering yields chunks in order
+# rather than building one string per asset, so a page can be spooled straight
+# into an upload. "{{ name }}" inserts an HTML-escaped value. "{{ name|safe }}"
+# inserts a value as-is: either a string or an iterable of chunks, such as
+# another template's output.
+TEMPLATE_SLOT = re.compile(r"\{\{\s*(\w+)(\|safe)?\s*\}\}")
+
+class CompiledTemplate:
+    """A template split into static text and slots, ready for repeated rendering."""
+
+    def __init__(self, source: str):
+        self.parts: List[Tuple[str, str]] = []
+        position = 0
+        for match in TEMPLATE_SLOT.finditer(source):
+            if match.start() > position:
+                self.parts.append(("text", source[position:match.start()]))
+            self.parts.append(("safe" if match.group(2) else "escape", match.group(1)))
+            position = match.end()
+        if position < len(source):
+            self.parts.append(("text", source[position:]))
+
+    def render(self, context: Dict[str, Any]) -> Iterator[str]:
+        for kind, value in self.parts:
+            if kind == "text":
+                yield value
+            elif kind == "escape":
+                yield html.escape(str(context[value]))
+            elif isinstance(context[value], str):
+                yield context[value]
+            else:
+                yield from context[value]
+
+BASE_STYLES = """
+            body { font-family: Arial, sans-serif; margin: 0; padding: 20px; color: #333; }
+            h1 { color: #2c3e50; }
+            .section { margin-bottom: 20px; }"""
+
+TEMPLATE_SOURCES = {
+    "page": """
     <!DOCTYPE html>
     <html>
     <head>
-        <title>E-Learning Module: {asset['original_document_name']}</title>
-        <style>
-            body {{ font-family: Arial, sans-serif; margin: 0; padding: 20px; color: #333; }}
-            .module {{ max-width: 800px; margin: 0 auto; background: #f9f9f9; padding: 20px; border-radius: 8px; }}
-            h1 {{ color: #2c3e50; }}
-            .section {{ margin-bottom: 20px; }}
-            .interactive {{ background: #e8f4fc; padding: 15px; border-radius: 5px; margin: 15px 0; }}
-            .question {{ background: #f0f7ea; padding: 15px; border-radius: 5px; margin: 15px 0; }}
+        <title>{{ title }}</title>
+        <style>{{ base_styles|safe }}{{ styles|safe }}
         </style>
     </head>
-    <body>
+    <body>{{ body|safe }}
+    </body>
+    </html>
+    """,
+    "elearning": """
         <div class="module">
-            <h1>Customer Onboarding Process</h1>
+            <h1>{{ title }}</h1>
             
             <div class="section">
                 <h2>Learning Objectives</h2>
@@ -157,32 +1816,7 @@ def process_elearning(asset: Dict[str, Any], document_text: str) -> str:
                     <li>Execute quality control measures effectively</li>
                 </ul>
             </div>
-            
-            <div class="section">
-                <h2>Module 1: Introduction to Onboarding</h2>
-                <p>This module covers the fundamentals of our customer onboarding process and why it matters.</p>
-                
-                <div class="interactive">
-                    <h3>Interactive Element: Onboarding Journey Map</h3>
-                    <p>Click through the customer journey to understand each touchpoint in the onboarding process.</p>
-                </div>
-            </div>
-            
-            <div class="section">
-                <h2>Module 2: Account Creation</h2>
-                <p>Learn the step-by-step process for creating and configuring new customer accounts.</p>
-                
-                <div class="interactive">
-                    <h3>Interactive Element: Account Setup Simulation</h3>
-                    <p>Practice creating an account with this interactive simulation.</p>
-                </div>
-            </div>
-            
-            <div class="section">
-                <h2>Module 3: Training and Handoff</h2>
-                <p>Discover best practices for training customers and transitioning them to the support team.</p>
-            </div>
-            
+            {{ sections|safe }}
             <div class="section">
                 <h2>Knowledge Check</h2>
                 
@@ -214,32 +1848,135 @@ def process_elearning(asset: Dict[str, Any], document_text: str) -> str:
                 <p>You've completed the Customer Onboarding Process training. Remember that all customer data must be handled according to our data protection policy and relevant regulations.</p>
                 <p>Next, you should explore the Support Escalation Process training module.</p>
             </div>
-        </div>
-    </body>
-    </html>
+        </div>""",
+    "elearning_section": """
+            <div class="section">
+                <h2>{{ number }} {{ title }}</h2>
+                <p>{{ introduction }}</p>
+                <ul>{{ items|safe }}</ul>
+                
+                <div class="interactive">
+                    <h3>Interactive Element: {{ title }}</h3>
+                    <p>Work through this step of the procedure in a guided simulation.</p>
+                </div>
+            </div>
+    """,
+    "process_map": """
+        <div class="map">
+            <h1>{{ title }}</h1>
+            <div class="nodes">{{ nodes|safe }}
+            </div>
+        </div>""",
+    "process_map_step": """
+                <div class="node" id="step-{{ number }}"><h3>{{ title }}</h3><ul>{{ items|safe }}</ul></div>""",
+    "job_aid": """
+        <div class="job-aid">
+            <h1>{{ title }}</h1>{{ blocks|safe }}
+        </div>""",
+    "job_aid_section": """<section><h3>{{ title }}</h3><ul class="checklist">{{ items|safe }}</ul></section>""",
+    "list_item": "<li>{{ text }}</li>"
+}
+
+ELEARNING_STYLES = """
+            .module { max-width: 800px; margin: 0 auto; background: #f9f9f9; padding: 20px; border-radius: 8px; }
+            .interactive { background: #e8f4fc; padding: 15px; border-radius: 5px; margin: 15px 0; }
+            .question { background: #f0f7ea; padding: 15px; border-radius: 5px; margin: 15px 0; }"""
+
+PROCESS_MAP_STYLES = """
+            .map { max-width: 1000px; margin: 0 auto; }
+            .nodes { display: flex; flex-wrap: wrap; gap: 16px; }
+            .node { flex: 1 1 220px; background: #e8f4fc; padding: 15px; border-radius: 5px; }"""
+
+JOB_AID_STYLES = """
+            .job-aid { max-width: 700px; margin: 0 auto; }
+            .checklist li { list-style: none; margin: 6px 0; }
+            .checklist li::before { content: "\\2610  "; }
+            @media print { body { margin: 0; } section { break-inside: avoid; } }"""
+
+TEMPLATES = {name: CompiledTemplate(source) for name, source in TEMPLATE_SOURCES.items()}
+
+def render_template(name: str, context: Dict[str, Any]) -> Iterator[str]:
+    """Render a compiled template as a stream of chunks."""
+    return TEMPLATES[name].render(context)
+
+def render_page(title: str, styles: str, body: Iterable[str]) -> Iterator[str]:
+    """Render a complete HTML page around a body stream, sharing the base layout and styles."""
+    return render_template("page", {"title": title, "base_styles": BASE_STYLES, "styles": styles, "body": body})
+
+def render_list_items(lines: Iterable[str]) -> Iterator[str]:
+    for line in lines:
+        yield from render_template("list_item", {"text": line})
+
+def render_elearning_section(asset: Dict[str, Any], section: Dict[str, Any]) -> str:
+    """Generate the e-learning screen for one SOP section."""
+    prompt = f"""
+    Transform the following SOP section into an engaging e-learning screen.
+    Target audience: {asset.get('audience', 'General employees')}
+    Tone: {asset.get('tone', 'Professional')}
+    Must include compliance text: {asset.get('compliance_text', 'N/A')}
+    
+    SOP section {section['number']} {section['title']}:
+    {chr(10).join(section['lines'])}
+    
+    Include an interactive element that lets the learner practice the section.
     """
+    introduction = generate_completion(prompt)
+    
+    return "".join(render_template("elearning_section", {
+        "number": section["number"],
+        "title": section["title"],
+        "introduction": introduction,
+        "items": render_list_items(line.lstrip("- ") for line in section["lines"])
+    }))
+
+def render_process_map_step(asset: Dict[str, Any], section: Dict[str, Any]) -> str:
+    """Generate the process map node for one procedure step."""
+    # Simulate processing time
+    simulate_work(1)
     
-    # In a real implementation, upload the file to Supabase Storage
-    # For now, simulate the upload and return a placeholder URL
-    storage_path = f"processed-assets/{filename}"
+    return "".join(render_template("process_map_step", {
+        "number": section["number"],
+        "title": section["title"],
+        "items": render_list_items(line.lstrip("- ") for line in section["lines"])
+    }))
+
+def render_job_aid_section(asset: Dict[str, Any], section: Dict[str, Any]) -> str:
+    """Generate the job aid checklist block for one SOP section."""
+    # Simulate processing time
+    simulate_work(0.5)
+    
+    return "".join(render_template("job_aid_section", {
+        "title": section["title"],
+        "items": render_list_items(line[2:] for line in section["lines"] if line.startswith("- "))
+    }))
+
+def process_elearning(asset: Dict[str, Any], outline: Dict[str, Any]) -> str:
+    """Process document into an e-learning module."""
+    print(f"Processing e-learning module for asset {asset['id']}")
     
-    # Simulate file upload to Supabase Storage
-    # In a real implementation, this would be:
-    # supabase.storage.from_("processed-assets").upload(filename, elearning_content)
+    # In a real implementation, this would also create a SCORM package or other e-learning format
+    fragments = generate_section_fragments(asset, outline["sections"], render_elearning_section)
     
-    # Generate a signed URL for the uploaded file
-    # In a real implementation, this would be:
-    # signed_url = supabase.storage.from_("processed-assets").create_signed_url(storage_path, 60 * 60 * 24 * 7)
+    # Simulate assembling the module
+    simulate_work(1)
     
-    # Return placeholder URL
-    return f"https://example.supabase.co/storage/v1/object/public/processed-assets/{filename}"
+    # Stream the module into the upload as it is rendered
+    body = render_template("elearning", {"title": outline["title"], "sections": fragments})
+    page = render_page(f"E-Learning Module: {asset['original_document_name']}", ELEARNING_STYLES, body)
+    
+    # In a real implementation, this would be uploaded as a SCORM package
+    return upload_output(page, ".html", "text/html")
 
-def process_video(asset: Dict[str, Any], document_text: str) -> str:
+def process_video(asset: Dict[str, Any], outline: Dict[str, Any]) -> str:
     """Process document into an avatar-based explainer video."""
     print(f"Processing video for asset {asset['id']}")
     
+    # One scene per top-level section of the SOP
+    scenes = [section["title"] for section in outline["sections"] if section["level"] == 1]
+    print(f"Rendering {len(scenes)} video scenes for asset {asset['id']}")
+    
     # Simulate processing time
-    time.sleep(8)
+    simulate_work(8)
     
     # Generate a filename for the output
     filename = f"video_{asset['id']}.mp4"
@@ -248,33 +1985,41 @@ def process_video(asset: Dict[str, Any], document_text: str) -> str:
     # For now, return a placeholder URL
     return f"https://example.supabase.co/storage/v1/object/public/processed-assets/{filename}"
 
-def process_process_map(asset: Dict[str, Any], document_text: str) -> str:
+def process_process_map(asset: Dict[str, Any], outline: Dict[str, Any]) -> str:
     """Process document into an interactive process map."""
     print(f"Processing process map for asset {asset['id']}")
     
-    # Simulate processing time
-    time.sleep(6)
+    # Each numbered sub-step becomes a node; fall back to top-level sections for flat SOPs
+    steps = [section for section in outline["sections"] if section["level"] > 1]
+    steps = steps or outline["sections"]
+    print(f"Mapping {len(steps)} process steps for asset {asset['id']}")
+    nodes = generate_section_fragments(asset, steps, render_process_map_step)
     
-    # Generate a filename for the output
-    filename = f"process_map_{asset['id']}.html"
+    # Simulate laying out the map
+    simulate_work(2)
     
-    # In a real implementation, this would create and upload the actual file
-    # For now, return a placeholder URL
-    return f"https://example.supabase.co/storage/v1/object/public/processed-assets/{filename}"
+    body = render_template("process_map", {"title": outline["title"], "nodes": nodes})
+    page = render_page(f"Process Map: {asset['original_document_name']}", PROCESS_MAP_STYLES, body)
+    return upload_output(page, ".html", "text/html")
 
-def process_job_aid(asset: Dict[str, Any], document_text: str) -> str:
+def process_job_aid(asset: Dict[str, Any], outline: Dict[str, Any]) -> str:
     """Process document into a PDF job aid."""
     print(f"Processing job aid for asset {asset['id']}")
     
-    # Simulate processing time
-    time.sleep(4)
+    # The checklist is made of the bullet points under each section
+    checklist_sections = [section for section in outline["sections"] if any(line.startswith("- ") for line in section["lines"])]
+    print(f"Laying out {len(checklist_sections)} checklist sections for asset {asset['id']}")
+    blocks = generate_section_fragments(asset, checklist_sections, render_job_aid_section)
     
-    # Generate a filename for the output
-    filename = f"job_aid_{asset['id']}.pdf"
+    # Simulate laying out the page
+    simulate_work(1)
     
-    # In a real implementation, this would create and upload the actual PDF file
-    # For now, return a placeholder URL
-    return f"https://example.supabase.co/storage/v1/object/public/processed-assets/{filename}"
+    body = render_template("job_aid", {"title": outline["title"], "blocks": blocks})
+    page = render_page(f"Job Aid: {asset['original_document_name']}", JOB_AID_STYLES, body)
+    
+    # In a real implementation, this would be rendered to PDF before uploading;
+    # for now the print-ready page is uploaded as is
+    return upload_output(page, ".html", "text/html")
 
 def process_asset(asset: Dict[str, Any]) -> None:
     """Process a single asset based on its type."""
@@ -286,41 +2031,707 @@ def process_asset(asset: Dict[str, Any]) -> None:
             update_asset_status(asset["id"], "failed")
             return
         
-        # Extract text from the original document
-        document_text = extract_text_from_document(asset["original_document_url"])
+        started_at = time.time()
+        asset_ids = [asset["id"]]
         
-        # Process the document based on asset type
-        processing_function = globals()[ASSET_TYPES[asset_type]]
-        output_url = processing_function(asset, document_text)
+        with metrics.track_asset(asset):
+            # Extract the original document, then outline it from the cached
+            # text without ever holding the whole text
+            document_url = asset["original_document_url"]
+            content_hash = checkpoint_store.run(asset_ids, "extract", lambda: timed_stage(
+                "extract", extract_document, document_url))
+            outline = timed_stage("outline", build_section_outline, iter_document_sections(document_url, content_hash))
+            
+            # Process the document based on asset type
+            processing_function = globals()[ASSET_TYPES[asset_type]]
+            output_url = checkpoint_store.run(asset_ids, "output", lambda: timed_stage(
+                "generate", processing_function, asset, outline))
+        asset_cost_model.observe(asset_type, time.time() - started_at)
         
         # Update asset status to completed
+        metrics.increment("tome_assets_processed_total", asset_type=asset_type, outcome="completed")
         update_asset_status(asset["id"], "completed", output_url)
         
     except Exception as e:
         print(f"Error processing asset {asset['id']}: {str(e)}")
-        update_asset_status(asset["id"], "failed")
+        retry_or_fail(asset, e)
+
+def run_stage_graph(stages: Dict[str, Tuple[List[str], Callable[[Dict[str, Any]], Any]]],
+                    executor: ThreadPoolExecutor) -> Tuple[Dict[str, Any], Dict[str, Exception]]:
+    """Run a DAG of stages on an executor, starting each stage as soon as its dependencies finish.
+    
+    `stages` maps a stage name to its dependency names and a function that receives
+    the results of all finished stages. Returns the results and errors by stage; a
+    stage whose dependency failed is recorded as failed without running.
+    """
+    results: Dict[str, Any] = {}
+    errors: Dict[str, Exception] = {}
+    pending = dict(stages)
+    running: Dict[Future, str] = {}
+    
+    while pending or running:
+        for name, (dependencies, function) in list(pending.items()):
+            failed = [dependency for dependency in dependencies if dependency in errors]
+            if failed:
+                errors[name] = RuntimeError(f"Stage {failed[0]} failed")
+                del pending[name]
+            elif all(dependency in results for dependency in dependencies):
+                running[executor.submit(function, dict(results))] = name
+                del pending[name]
+        
+        if not running:
+            if pending:
+                raise ValueError(f"Unsatisfiable stage dependencies: {sorted(pending)}")
+            break
+        
+        done, _ = wait(running, return_when=FIRST_COMPLETED)
+        for future in done:
+            name = running.pop(future)
+            try:
+                results[name] = future.result()
+            except Exception as e:
+                errors[name] = e
+    
+    return results, errors
+
+def timed_stage(stage: str, function: Callable, *args, asset_type: Optional[str] = None) -> Any:
+    """Call a function, recording its duration in the stage latency histogram."""
+    with metrics.timed(stage, asset_type):
+        return function(*args)
+
+def run_timed_stage(asset: Dict[str, Any], processing_function: Callable, *args) -> str:
+    """Run an asset's processing stage and feed its duration to the cost model."""
+    started_at = time.time()
+    with metrics.track_asset(asset):
+        output_url = timed_stage("generate", processing_function, asset, *args)
+    asset_cost_model.observe(asset.get("asset_type"), time.time() - started_at)
+    return output_url
 
-def main_loop():
-    """Main processing loop."""
-    print("Starting document processing worker...")
+def process_document_group(assets: List[Dict[str, Any]], executor: ThreadPoolExecutor) -> None:
+    """Process every asset ordered from one document, extracting and outlining it only once."""
+    document_url = assets[0]["original_document_url"]
+    print(f"Processing {len(assets)} assets from {document_url}")
     
-    while True:
+    valid_assets = []
+    for asset in assets:
+        asset_type = asset.get("asset_type")
+        if not asset_type or asset_type not in ASSET_TYPES:
+            print(f"Unknown asset type: {asset_type}")
+            update_asset_status(asset["id"], "failed")
+        else:
+            valid_assets.append(asset)
+    if not valid_assets:
+        return
+    
+    # Document stages are shared by every asset in the group. Failed assets are
+    # left out: their checkpoints were already cleared when they failed
+    asset_ids = [asset["id"] for asset in valid_assets]
+    asset_types = {asset.get("asset_type") for asset in valid_assets}
+    group_type = asset_types.pop() if len(asset_types) == 1 else "mixed"
+    
+    stages: Dict[str, Tuple[List[str], Callable[[Dict[str, Any]], Any]]] = {
+        "extract": ([], lambda results: checkpoint_store.run(asset_ids, "extract", lambda: timed_stage(
+            "extract", extract_document, document_url, asset_type=group_type))),
+        "outline": (["extract"], lambda results: timed_stage(
+            "outline", build_section_outline, iter_document_sections(document_url, results["extract"]),
+            asset_type=group_type))
+    }
+    
+    for asset in valid_assets:
+        processing_function = globals()[ASSET_TYPES[asset["asset_type"]]]
+        stages[f"asset:{asset['id']}"] = (
+            ["outline"],
+            lambda results, asset=asset, processing_function=processing_function:
+                checkpoint_store.run([asset["id"]], "output", lambda: run_timed_stage(
+                    asset, processing_function, results["outline"]))
+        )
+    
+    results, errors = run_stage_graph(stages, executor)
+    
+    for stage, error in errors.items():
+        if not stage.startswith("asset:"):
+            print(f"Error in {stage} stage for {document_url}: {str(error)}")
+    
+    for asset in valid_assets:
+        stage = f"asset:{asset['id']}"
+        if stage in results:
+            metrics.increment("tome_assets_processed_total", asset_type=asset.get("asset_type"), outcome="completed")
+            update_asset_status(asset["id"], "completed", results[stage])
+        elif stage in errors:
+            print(f"Error processing asset {asset['id']}: {str(errors[stage])}")
+            retry_or_fail(asset, errors[stage])
+
+def group_by_document(assets: List[Dict[str, Any]]) -> List[List[Dict[str, Any]]]:
+    """Group assets by their source document, keeping the order in which documents first appear."""
+    groups: Dict[str, List[Dict[str, Any]]] = {}
+    for asset in assets:
+        groups.setdefault(asset.get("original_document_url"), []).append(asset)
+    return list(groups.values())
+
+# Scheduling. Rather than claiming assets strictly oldest first, the worker
+# looks at a window of up to SCHEDULER_CANDIDATE_WINDOW claimable assets, the
+# oldest SCHEDULER_CANDIDATES_PER_TENANT of each tenant, and claims
+# them in the order chosen by AssetScheduler: weighted fair queuing across
+# tenants (organizations), weighted by credit tier, and within a tenant the
+# cheapest asset types first, using per-type durations learned from completed
+# assets. Waiting time gradually discounts an asset's cost, and anything older
+# than SCHEDULER_MAX_WAIT_SECONDS jumps the queue, which bounds tail latency.
+# Credit tiers are read from the organizations table and cached for
+# CREDIT_TIER_TTL_SECONDS; organizations without one count as "starter".
+SCHEDULER_CANDIDATE_WINDOW = int(os.getenv("SCHEDULER_CANDIDATE_WINDOW", "500"))
+SCHEDULER_CANDIDATES_PER_TENANT = int(os.getenv("SCHEDULER_CANDIDATES_PER_TENANT", "50"))
+SCHEDULER_MAX_WAIT_SECONDS = float(os.getenv("SCHEDULER_MAX_WAIT_SECONDS", "1800"))
+# Seconds of estimated cost forgiven for every second an asset has waited
+SCHEDULER_AGING_RATE = float(os.getenv("SCHEDULER_AGING_RATE", "0.01"))
+CREDIT_TIER_TTL_SECONDS = float(os.getenv("CREDIT_TIER_TTL_SECONDS", "300"))
+CREDIT_TIER_WEIGHTS = {
+    "starter": 1.0,
+    "professional": 2.0,
+    "enterprise": 4.0
+}
+# Starting estimates of end-to-end processing time per asset type, in seconds
+DEFAULT_ASSET_COST_SECONDS = {
+    "e-learning": 7.0,
+    "video": 10.0,
+    "process-map": 8.0,
+    "job-aid": 6.0
+}
+
+class CostModel:
+    """Exponentially weighted moving average of observed processing time per asset type."""
+
+    def __init__(self, defaults: Optional[Dict[str, float]] = None, smoothing: float = 0.2):
+        self.smoothing = smoothing
+        self._estimates = dict(DEFAULT_ASSET_COST_SECONDS if defaults is None else defaults)
+        self._lock = threading.Lock()
+
+    def estimate(self, asset_type: Optional[str]) -> float:
+        with self._lock:
+            if asset_type in self._estimates:
+                return self._estimates[asset_type]
+            return max(self._estimates.values(), default=1.0)
+
+    def observe(self, asset_type: Optional[str], seconds: float) -> None:
+        with self._lock:
+            previous = self._estimates.get(asset_type)
+            self._estimates[asset_type] = seconds if previous is None else previous + self.smoothing * (seconds - previous)
+
+    def estimates(self) -> Dict[str, float]:
+        with self._lock:
+            return dict(self._estimates)
+
+asset_cost_model = CostModel()
+
+class CreditTiers:
+    """Cache of each organization's credit tier, looked up in batches."""
+
+    def __init__(self, ttl_seconds: float = CREDIT_TIER_TTL_SECONDS):
+        self.ttl_seconds = ttl_seconds
+        # Organization ID -> (tier, time the entry goes stale)
+        self._tiers: Dict[str, Tuple[str, float]] = {}
+        self._lock = threading.Lock()
+
+    def prefetch(self, organization_ids: Iterable[Optional[str]]) -> None:
+        """Load the tiers of organizations that are not cached or have gone stale, in one query."""
+        now = time.time()
+        with self._lock:
+            missing = sorted({
+                str(organization_id) for organization_id in organization_ids
+                if organization_id and self._tiers.get(str(organization_id), ("", 0.0))[1] <= now
+            })
+        if not missing:
+            return
+        
         try:
-            # Fetch pending assets
-            assets = fetch_pending_assets()
+            response = supabase.table("organizations").select("id,credit_tier").in_("id", missing).execute()
+        except Exception as e:
+            # Keep scheduling with whatever tiers are cached
+            print(f"Error loading credit tiers: {str(e)}")
+            return
+        
+        found = {str(row["id"]): row.get("credit_tier") or "starter" for row in response.data or []}
+        with self._lock:
+            for organization_id in missing:
+                self._tiers[organization_id] = (found.get(organization_id, "starter"), now + self.ttl_seconds)
+
+    def tier(self, organization_id: Optional[str]) -> str:
+        with self._lock:
+            entry = self._tiers.get(str(organization_id))
+        return entry[0] if entry else "starter"
+
+credit_tiers = CreditTiers()
+
+def parse_timestamp(value: Optional[str]) -> Optional[float]:
+    """Parse an ISO 8601 timestamp from Supabase into epoch seconds."""
+    if not value:
+        return None
+    try:
+        moment = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    except ValueError:
+        return None
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=timezone.utc)
+    return moment.timestamp()
+
+class AssetScheduler:
+    """Orders claimable assets by weighted fair queuing across tenants and cost within a tenant."""
+
+    def __init__(self, cost_model: CostModel = asset_cost_model, tier_weights: Optional[Dict[str, float]] = None,
+                 aging_rate: float = SCHEDULER_AGING_RATE, max_wait_seconds: float = SCHEDULER_MAX_WAIT_SECONDS,
+                 tiers: CreditTiers = credit_tiers):
+        self.cost_model = cost_model
+        self.tiers = tiers
+        self.tier_weights = dict(CREDIT_TIER_WEIGHTS if tier_weights is None else tier_weights)
+        self.aging_rate = aging_rate
+        self.max_wait_seconds = max_wait_seconds
+        # Virtual finish time per tenant: the weighted service it has received
+        self._finish: Dict[str, float] = {}
+        self._virtual_time = 0.0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def tenant(asset: Dict[str, Any]) -> str:
+        return asset.get("organization_id") or asset.get("user_id") or "anonymous"
+
+    def weight(self, asset: Dict[str, Any]) -> float:
+        return self.tier_weights.get(self.tiers.tier(asset.get("organization_id")), 1.0)
+
+    def _waited(self, asset: Dict[str, Any], now: float) -> float:
+        created_at = parse_timestamp(asset.get("created_at"))
+        return max(0.0, now - created_at) if created_at is not None else 0.0
+
+    def rank(self, candidates: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Return the candidates in the order they should be claimed."""
+        now = time.time()
+        # dispatched() charges claimed assets with the same cached tiers
+        self.tiers.prefetch(asset.get("organization_id") for asset in candidates)
+        
+        # Assets that have waited too long go first, oldest first
+        overdue = [asset for asset in candidates if self._waited(asset, now) >= self.max_wait_seconds]
+        overdue.sort(key=lambda asset: -self._waited(asset, now))
+        overdue_ids = {asset["id"] for asset in overdue}
+        
+        # Within a tenant, cheapest (after aging) first
+        queues: Dict[str, List[Tuple[float, Dict[str, Any]]]] = {}
+        for asset in candidates:
+            if asset["id"] in overdue_ids:
+                continue
+            cost = self.cost_model.estimate(asset.get("asset_type"))
+            aged_cost = cost - self.aging_rate * self._waited(asset, now)
+            queues.setdefault(self.tenant(asset), []).append((aged_cost, asset))
+        for queue in queues.values():
+            queue.sort(key=lambda entry: entry[0])
+            queue.reverse()
+        
+        with self._lock:
+            finish = {tenant: max(self._finish.get(tenant, 0.0), self._virtual_time) for tenant in queues}
+        
+        # Across tenants, repeatedly serve the tenant whose next asset would finish
+        # first in virtual time if every tenant were served at its weighted share
+        ranked = list(overdue)
+        while queues:
+            def next_finish(tenant: str) -> float:
+                asset = queues[tenant][-1][1]
+                return finish[tenant] + self.cost_model.estimate(asset.get("asset_type")) / self.weight(asset)
             
-            # Process each asset
-            for asset in assets:
-                process_asset(asset)
+            tenant = min(queues, key=next_finish)
+            finish[tenant] = next_finish(tenant)
+            ranked.append(queues[tenant].pop()[1])
+            if not queues[tenant]:
+                del queues[tenant]
+        
+        return ranked
+
+    def dispatched(self, asset: Dict[str, Any]) -> None:
+        """Charge an asset that is about to be processed to its tenant."""
+        tenant = self.tenant(asset)
+        with self._lock:
+            start = max(self._finish.get(tenant, 0.0), self._virtual_time)
+            self._finish[tenant] = start + self.cost_model.estimate(asset.get("asset_type")) / self.weight(asset)
+            self._virtual_time = start
+
+def claim_scheduled_assets(scheduler: AssetScheduler, limit: int, type_capacity: Optional[Dict[str, int]] = None) -> List[Dict[str, Any]]:
+    """Claim up to `limit` assets in scheduler order, skipping types with no free capacity."""
+    if limit <= 0:
+        return []
+    
+    ranked = scheduler.rank(fetch_claim_candidates(SCHEDULER_CANDIDATE_WINDOW, SCHEDULER_CANDIDATES_PER_TENANT))
+    
+    if type_capacity is not None:
+        capacity = dict(type_capacity)
+        admissible = []
+        for candidate in ranked:
+            asset_type = candidate.get("asset_type")
+            if capacity.get(asset_type, limit) > 0:
+                capacity[asset_type] = capacity.get(asset_type, limit) - 1
+                admissible.append(candidate)
+        ranked = admissible
+    
+    claimed = claim_assets(ranked, limit)
+    for asset in claimed:
+        scheduler.dispatched(asset)
+    return claimed
+
+class AssetWorkerPool:
+    """Thread pool that runs process_asset with a global and per-type in-flight limit."""
+
+    def __init__(self, max_workers: int = WORKER_CONCURRENCY, type_limits: Optional[Dict[str, int]] = None,
+                 on_release: Optional[Callable[[], None]] = None):
+        self.max_workers = max_workers
+        self.type_limits = dict(ASSET_TYPE_CONCURRENCY if type_limits is None else type_limits)
+        self.on_release = on_release
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="asset-worker")
+        # Pipeline stages run on their own executor so a document group waiting
+        # on its stages never blocks the stages themselves
+        self._stage_executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="asset-stage")
+        self._condition = threading.Condition()
+        self._in_flight: Dict[str, str] = {}
+        self._type_counts: Dict[str, int] = {}
+
+    def free_slots(self) -> int:
+        """Number of additional assets the pool can accept right now."""
+        with self._condition:
+            return self.max_workers - len(self._in_flight)
+
+    def type_capacity(self) -> Dict[str, int]:
+        """Number of additional assets of each known type the pool can accept right now."""
+        with self._condition:
+            return {asset_type: limit - self._type_counts.get(asset_type, 0) for asset_type, limit in self.type_limits.items()}
+
+    def in_flight_ids(self) -> List[str]:
+        """IDs of the assets currently being processed."""
+        with self._condition:
+            return list(self._in_flight)
+
+    def _reserve(self, assets: List[Dict[str, Any]]) -> bool:
+        """Reserve slots for all of the assets or none of them."""
+        with self._condition:
+            if any(asset["id"] in self._in_flight for asset in assets):
+                return False
             
-            # Sleep before checking for new assets
-            if not assets:
-                print("No pending assets, sleeping...")
-                time.sleep(10)
+            # An idle pool always accepts work, so a group larger than the
+            # limits still gets processed
+            if self._in_flight:
+                if len(self._in_flight) + len(assets) > self.max_workers:
+                    return False
+                
+                requested: Dict[str, int] = {}
+                for asset in assets:
+                    asset_type = asset.get("asset_type")
+                    requested[asset_type] = requested.get(asset_type, 0) + 1
+                
+                # Unknown types have no limit of their own; they are failed fast
+                for asset_type, count in requested.items():
+                    type_limit = self.type_limits.get(asset_type, self.max_workers)
+                    if self._type_counts.get(asset_type, 0) + count > type_limit:
+                        return False
             
+            for asset in assets:
+                self._in_flight[asset["id"]] = asset.get("asset_type")
+                self._type_counts[asset.get("asset_type")] = self._type_counts.get(asset.get("asset_type"), 0) + 1
+            return True
+
+    def _release(self, assets: List[Dict[str, Any]]) -> None:
+        with self._condition:
+            for asset in assets:
+                asset_type = self._in_flight.pop(asset["id"])
+                self._type_counts[asset_type] -= 1
+            self._condition.notify_all()
+        
+        if self.on_release:
+            self.on_release()
+
+    def _run(self, assets: List[Dict[str, Any]], function: Callable, *args) -> None:
+        try:
+            function(*args)
+        finally:
+            self._release(assets)
+
+    def try_submit(self, asset: Dict[str, Any]) -> bool:
+        """Start processing an asset if both the global and per-type limits allow it."""
+        if not self._reserve([asset]):
+            return False
+        
+        self._executor.submit(self._run, [asset], process_asset, asset)
+        return True
+
+    def try_submit_group(self, assets: List[Dict[str, Any]]) -> bool:
+        """Start processing a group of assets from one document if the limits allow all of them."""
+        if not self._reserve(assets):
+            return False
+        
+        self._executor.submit(self._run, assets, process_document_group, assets, self._stage_executor)
+        return True
+
+    def shutdown(self, wait: bool = True) -> None:
+        """Stop accepting work and optionally wait for in-flight assets to finish."""
+        self._executor.shutdown(wait=wait)
+        self._stage_executor.shutdown(wait=wait)
+
+# Job pickup. Instead of polling on a fixed interval, the worker sleeps on a
+# WorkSignal that wakes it as soon as new work may be available: when a Postgres
+# NOTIFY arrives on ASSET_NOTIFY_CHANNEL (see the assets_pending_notify trigger)
+# or an in-flight asset finishes. Without a DATABASE_URL, or while the listener
+# is disconnected, it falls back to polling with exponential backoff from
+# WORKER_IDLE_MIN_SECONDS up to WORKER_IDLE_MAX_SECONDS. While notifications
+# are flowing it only polls every WORKER_IDLE_LISTENING_SECONDS as a safety net.
+DATABASE_URL = os.getenv("DATABASE_URL")
+ASSET_NOTIFY_CHANNEL = os.getenv("ASSET_NOTIFY_CHANNEL", "assets_pending")
+WORKER_IDLE_MIN_SECONDS = float(os.getenv("WORKER_IDLE_MIN_SECONDS", "0.25"))
+WORKER_IDLE_MAX_SECONDS = float(os.getenv("WORKER_IDLE_MAX_SECONDS", "10"))
+WORKER_IDLE_LISTENING_SECONDS = float(os.getenv("WORKER_IDLE_LISTENING_SECONDS", "60"))
+WORKER_ERROR_MAX_SECONDS = float(os.getenv("WORKER_ERROR_MAX_SECONDS", "30"))
+
+class WorkSignal:
+    """Wakes the worker loop on new work, backing off exponentially while there is none."""
+
+    def __init__(self, min_delay: float = WORKER_IDLE_MIN_SECONDS, max_delay: float = WORKER_IDLE_MAX_SECONDS,
+                 listening_delay: float = WORKER_IDLE_LISTENING_SECONDS, max_error_delay: float = WORKER_ERROR_MAX_SECONDS):
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self.listening_delay = listening_delay
+        self.max_error_delay = max_error_delay
+        self.listening = False
+        self._delay = min_delay
+        self._errors = 0
+        self._event = threading.Event()
+        self._stopped = threading.Event()
+
+    def wake(self) -> None:
+        """Wake the worker loop immediately."""
+        self._event.set()
+
+    def reset(self) -> None:
+        """Work was found: poll again straight away next time the loop is idle."""
+        self._delay = self.min_delay
+        self._errors = 0
+
+    def idle(self, announce: bool = True) -> None:
+        """Wait until woken or the current backoff elapses, then lengthen the backoff."""
+        if announce and self._delay == self.min_delay:
+            print("No pending assets, waiting for new work...")
+        
+        delay = self.listening_delay if self.listening else self._delay
+        self._event.wait(delay)
+        self._event.clear()
+        self._delay = min(self.max_delay, self._delay * 2)
+
+    def error(self) -> None:
+        """Back off exponentially after consecutive errors in the loop."""
+        self._errors += 1
+        self._event.wait(min(self.max_error_delay, 2 ** (self._errors - 1)))
+        self._event.clear()
+
+    def stop(self) -> None:
+        """Stop the worker loop and any listener feeding this signal."""
+        self._stopped.set()
+        self.wake()
+
+    def stopped(self) -> bool:
+        return self._stopped.is_set()
+
+def listen_for_assets(wakeup: WorkSignal, database_url: str, channel: str = ASSET_NOTIFY_CHANNEL) -> None:
+    """Wake `wakeup` on every Postgres notification for new pending assets, reconnecting on failure."""
+    # Only workers with a direct database connection need a Postgres driver
+    import psycopg
+    
+    while not wakeup.stopped():
+        try:
+            with psycopg.connect(database_url, autocommit=True) as connection:
+                connection.execute(f"LISTEN {channel}")
+                wakeup.listening = True
+                # Catch up on anything inserted while we were not listening
+                wakeup.wake()
+                
+                while not wakeup.stopped():
+                    for _ in connection.notifies(timeout=1.0):
+                        wakeup.wake()
+        except Exception as e:
+            print(f"Error listening for new assets: {str(e)}")
+            time.sleep(5)
+        finally:
+            wakeup.listening = False
+
+def start_asset_listener(wakeup: WorkSignal, database_url: Optional[str] = DATABASE_URL) -> None:
+    """Start listening for new assets in the background, if a database URL is configured."""
+    if not database_url:
+        return
+    
+    threading.Thread(target=listen_for_assets, args=(wakeup, database_url), name="asset-listener", daemon=True).start()
+
+# Drain mode. Instead of running forever, a worker started with --drain
+# processes what is pending and exits once a claim comes back empty and
+# everything it claimed has finished, which suits cron jobs and serverless
+# functions. A DrainBudget also stops it claiming after --max-assets assets or
+# --max-seconds seconds; assets already claimed are still finished, so the time
+# budget should leave room for the slowest asset below the platform's timeout.
+class DrainBudget:
+    """Limits a drain run to a number of claimed assets and a wall-clock time."""
+
+    def __init__(self, max_assets: Optional[int] = None, max_seconds: Optional[float] = None):
+        self.max_assets = max_assets
+        self.deadline = time.monotonic() + max_seconds if max_seconds else None
+        self.claimed = 0
+
+    def allowance(self, limit: int) -> int:
+        """How many of `limit` assets may still be claimed."""
+        if self.deadline is not None and time.monotonic() >= self.deadline:
+            return 0
+        if self.max_assets is not None:
+            limit = min(limit, self.max_assets - self.claimed)
+        return max(0, limit)
+
+    def exhausted(self) -> bool:
+        return self.allowance(1) == 0
+
+def run_concurrent_loop(pool: AssetWorkerPool, wakeup: WorkSignal, scheduler: AssetScheduler, pipeline: bool = False,
+                        drain: Optional[DrainBudget] = None) -> None:
+    """Keep the pool full, claiming new assets whenever a slot frees up.
+    
+    On the way out, waits for in-flight assets to finish before the lease
+    heartbeat stops, so no other worker can reclaim them meanwhile.
+    """
+    # Claimed assets that the per-type limits have not let in yet
+    backlog: List[Dict[str, Any]] = []
+    heartbeat = LeaseHeartbeat(lambda: pool.in_flight_ids() + [asset["id"] for asset in backlog]).start()
+    
+    try:
+        while not wakeup.stopped():
+            try:
+                limit = pool.free_slots() - len(backlog)
+                if drain:
+                    limit = drain.allowance(limit)
+                claimed = claim_scheduled_assets(scheduler, limit, pool.type_capacity())
+                backlog += claimed
+                if drain:
+                    drain.claimed += len(claimed)
+                    # Done once nothing more will be claimed and all claimed work has started
+                    if not backlog and (drain.exhausted() or not claimed and not pool.in_flight_ids()):
+                        return
+                waiting = len(backlog)
+                
+                # Submit everything the limits allow; the rest waits for a free slot
+                if pipeline:
+                    groups = group_by_document(backlog)
+                    backlog = [asset for group in groups if not pool.try_submit_group(group) for asset in group]
+                else:
+                    backlog = [asset for asset in backlog if not pool.try_submit(asset)]
+                
+                # Sleep until an asset finishes or a new one arrives unless we made progress
+                if claimed or len(backlog) < waiting:
+                    wakeup.reset()
+                else:
+                    wakeup.idle(announce=not backlog and not pool.in_flight_ids())
+                
+            except Exception as e:
+                print(f"Error in main loop: {str(e)}")
+                if drain:
+                    raise
+                wakeup.error()
+    finally:
+        try:
+            release_claims([asset["id"] for asset in backlog])
         except Exception as e:
-            print(f"Error in main loop: {str(e)}")
-            time.sleep(30)  # Sleep longer on error
+            print(f"Error releasing claimed assets: {str(e)}")
+        pool.shutdown()
+        heartbeat.stop()
+
+def main_loop(mode: Optional[str] = None, drain: Optional[DrainBudget] = None):
+    """Main processing loop. With a DrainBudget, returns once the pending work is done."""
+    mode = mode or WORKER_MODE
+    print(f"Starting document processing worker ({mode} mode{', draining' if drain else ''})...")
+    
+    wakeup = WorkSignal()
+    
+    # On SIGTERM, stop claiming and let in-flight assets finish; pending status
+    # updates are flushed on the way out. The handler hands off to a thread
+    # because setting the signal's event from the handler could deadlock with a
+    # wait the main thread is in the middle of
+    def request_stop(signum, frame):
+        print("Stopping after in-flight assets finish...")
+        threading.Thread(target=wakeup.stop, name="worker-stop").start()
+    
+    if threading.current_thread() is threading.main_thread():
+        signal.signal(signal.SIGTERM, request_stop)
+    
+    if not drain:
+        start_asset_listener(wakeup)
+    scheduler = AssetScheduler()
+    metrics_server = MetricsServer(metrics).start() if METRICS_PORT else None
+    
+    try:
+        if mode in ("concurrent", "pipeline"):
+            pool = AssetWorkerPool(on_release=wakeup.wake)
+            run_concurrent_loop(pool, wakeup, scheduler, pipeline=mode == "pipeline", drain=drain)
+            return
+        
+        current: List[str] = []
+        heartbeat = LeaseHeartbeat(lambda: list(current)).start()
+        
+        try:
+            while not wakeup.stopped():
+                try:
+                    # Claim the next pending asset
+                    assets = claim_scheduled_assets(scheduler, drain.allowance(1) if drain else 1)
+                    if drain:
+                        drain.claimed += len(assets)
+                    
+                    # Process each asset
+                    for asset in assets:
+                        current[:] = [asset["id"]]
+                        process_asset(asset)
+                        current.clear()
+                    
+                    # Wait for new assets
+                    if assets:
+                        wakeup.reset()
+                    elif drain:
+                        return
+                    else:
+                        wakeup.idle()
+                    
+                except Exception as e:
+                    print(f"Error in main loop: {str(e)}")
+                    if drain:
+                        raise
+                    wakeup.error()
+        finally:
+            heartbeat.stop()
+    finally:
+        wakeup.stop()
+        status_sink.close()
+        if metrics_server:
+            metrics_server.stop()
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Process pending TOME assets.")
+    parser.add_argument("--mode", choices=["sequential", "concurrent", "pipeline"], default=WORKER_MODE)
+    parser.add_argument("--drain", action="store_true", help="process the pending assets, then exit")
+    parser.add_argument("--max-assets", type=int, help="with --drain, stop claiming after this many assets")
+    parser.add_argument("--max-seconds", type=float, help="with --drain, stop claiming after this many seconds")
+    args = parser.parse_args(argv)
+    if (args.max_assets is not None or args.max_seconds is not None) and not args.drain:
+        parser.error("--max-assets and --max-seconds require --drain")
+    
+    startup_seconds = time.perf_counter() - IMPORT_STARTED_AT
+    metrics.set_gauge("tome_worker_startup_seconds", startup_seconds)
+    print(f"Worker started in {startup_seconds * 1000:.0f} ms")
+    
+    if not args.drain:
+        main_loop(args.mode)
+        return 0
+    
+    drain = DrainBudget(args.max_assets, args.max_seconds)
+    started = time.perf_counter()
+    try:
+        main_loop(args.mode, drain)
+    except Exception as e:
+        print(f"Drain stopped after {drain.claimed} assets: {str(e)}")
+        return 1
+    
+    reason = "budget reached" if drain.exhausted() else "queue empty"
+    print(f"Drained {drain.claimed} assets in {time.perf_counter() - started:.1f}s ({reason})")
+    return 0
 
 if __name__ == "__main__":
-    main_loop()
+    sys.exit(main())
@@ -0,0 +1,566 @@
+import os
+import json
+import uuid
+import time
+import random
+import threading
+import copy
+import itertools
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Any, List, Optional, Tuple
+
+# Local stand-ins for the hosted services used by the document worker.
+# They implement just enough of each client's interface for the worker to run
+# unchanged against them, e.g. in tests or when exercising several workers
+# on one machine:
+#
+#     import document_processor
+#     document_processor.supabase = LocalSupabaseClient()
+#
+# Each stand-in takes a latency and an error rate, so benchmarks can model
+# slow or unreliable services.
+#
+#     server = LocalOpenAIServer(requests_per_minute=60).start()
+#     openai.base_url = server.base_url
+#
+#     document_processor.output_uploader.storage = LocalDirectoryStorage("/tmp/outputs")
+
+class LocalResponse:
+    """Mirror of the postgrest response object: rows are exposed as .data."""
+
+    def __init__(self, data: List[Dict[str, Any]]):
+        self.data = data
+
+def _simulate_request(latency: float, error_rate: float, service: str) -> None:
+    """Delay a request by `latency` seconds and fail `error_rate` of requests."""
+    if latency:
+        time.sleep(latency)
+    if error_rate and random.random() < error_rate:
+        raise ConnectionError(f"Simulated {service} failure")
+
+def _utc_now(offset_seconds: float = 0) -> str:
+    moment = datetime.now(timezone.utc) + timedelta(seconds=offset_seconds)
+    return moment.strftime("%Y-%m-%dT%H:%M:%S.%fZ")
+
+def _coerce(value: Any, like: Any) -> Any:
+    """Convert a filter value parsed from a PostgREST string to the column's type."""
+    if isinstance(value, str) and like is not None and not isinstance(like, str):
+        try:
+            return type(like)(value)
+        except (TypeError, ValueError):
+            return value
+    return value
+
+def _matches(row_value: Any, op: str, value: Any) -> bool:
+    if op == "is":
+        if value in (None, "null"):
+            return row_value is None
+        return row_value is _coerce(value, True)
+    if op == "in":
+        return row_value in value
+    if row_value is None:
+        return False
+    value = _coerce(value, row_value)
+    if op == "eq":
+        return row_value == value
+    if op == "neq":
+        return row_value != value
+    if op == "lt":
+        return row_value < value
+    if op == "lte":
+        return row_value <= value
+    if op == "gt":
+        return row_value > value
+    if op == "gte":
+        return row_value >= value
+    raise ValueError(f"Unsupported filter operator: {op}")
+
+def _parse_or(filters: str) -> List[Tuple[str, str, str]]:
+    """Parse a PostgREST or= filter such as "claimed_by.is.null,lease_expires_at.lt.2024-01-01"."""
+    conditions = []
+    for condition in filters.split(","):
+        column, op, value = condition.split(".", 2)
+        conditions.append((column, op, value))
+    return conditions
+
+class LocalTableQuery:
+    """Chainable query builder over one in-memory table."""
+
+    def __init__(self, table: "LocalTable"):
+        self._table = table
+        self._action = "select"
+        self._payload: Any = None
+        self._on_conflict = "id"
+        self._filters: List[List[Tuple[str, str, Any]]] = []
+        self._order: Optional[Tuple[str, bool]] = None
+        self._limit: Optional[int] = None
+
+    def select(self, columns: str = "*") -> "LocalTableQuery":
+        self._action = "select"
+        self._payload = None if columns == "*" else [c.strip() for c in columns.split(",")]
+        return self
+
+    def insert(self, rows: Any) -> "LocalTableQuery":
+        self._action = "insert"
+        self._payload = rows if isinstance(rows, list) else [rows]
+        return self
+
+    def upsert(self, rows: Any, on_conflict: str = "id") -> "LocalTableQuery":
+        self._action = "upsert"
+        self._payload = rows if isinstance(rows, list) else [rows]
+        self._on_conflict = on_conflict
+        return self
+
+    def update(self, data: Dict[str, Any]) -> "LocalTableQuery":
+        self._action = "update"
+        self._payload = data
+        return self
+
+    def delete(self) -> "LocalTableQuery":
+        self._action = "delete"
+        return self
+
+    def _filter(self, column: str, op: str, value: Any) -> "LocalTableQuery":
+        self._filters.append([(column, op, value)])
+        return self
+
+    def eq(self, column: str, value: Any) -> "LocalTableQuery":
+        return self._filter(column, "eq", value)
+
+    def neq(self, column: str, value: Any) -> "LocalTableQuery":
+        return self._filter(column, "neq", value)
+
+    def lt(self, column: str, value: Any) -> "LocalTableQuery":
+        return self._filter(column, "lt", value)
+
+    def lte(self, column: str, value: Any) -> "LocalTableQuery":
+        return self._filter(column, "lte", value)
+
+    def gt(self, column: str, value: Any) -> "LocalTableQuery":
+        return self._filter(column, "gt", value)
+
+    def gte(self, column: str, value: Any) -> "LocalTableQuery":
+        return self._filter(column, "gte", value)
+
+    def is_(self, column: str, value: Any) -> "LocalTableQuery":
+        return self._filter(column, "is", value)
+
+    def in_(self, column: str, values: List[Any]) -> "LocalTableQuery":
+        return self._filter(column, "in", list(values))
+
+    def or_(self, filters: str) -> "LocalTableQuery":
+        self._filters.append(_parse_or(filters))
+        return self
+
+    def order(self, column: str, desc: bool = False) -> "LocalTableQuery":
+        self._order = (column, desc)
+        return self
+
+    def limit(self, size: int) -> "LocalTableQuery":
+        self._limit = size
+        return self
+
+    def _row_matches(self, row: Dict[str, Any]) -> bool:
+        # Filters are AND-ed together; the conditions inside one or_() are OR-ed
+        return all(
+            any(_matches(row.get(column), op, value) for column, op, value in group)
+            for group in self._filters
+        )
+
+    def execute(self) -> LocalResponse:
+        return self._table.execute(self)
+
+class LocalTable:
+    """In-memory table. Each query executes atomically, like a single SQL statement."""
+
+    def __init__(self, name: str, latency: float = 0.0, error_rate: float = 0.0):
+        self.name = name
+        self.latency = latency
+        self.error_rate = error_rate
+        self.rows: Dict[Any, Dict[str, Any]] = {}
+        self.request_count = 0
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+
+    def _resolve(self, data: Dict[str, Any]) -> Dict[str, Any]:
+        return {key: (_utc_now() if value == "now()" else value) for key, value in data.items()}
+
+    def _selected(self, query: LocalTableQuery) -> List[Dict[str, Any]]:
+        rows = [row for row in self.rows.values() if query._row_matches(row)]
+        if query._order:
+            column, desc = query._order
+            rows.sort(key=lambda row: (row.get(column) is None, row.get(column) or ""), reverse=desc)
+        if query._limit is not None:
+            rows = rows[:query._limit]
+        return rows
+
+    def execute(self, query: LocalTableQuery) -> LocalResponse:
+        _simulate_request(self.latency, self.error_rate, "database")
+        with self._lock:
+            self.request_count += 1
+
+            if query._action == "select":
+                rows = self._selected(query)
+                if query._payload:
+                    rows = [{column: row.get(column) for column in query._payload} for row in rows]
+                return LocalResponse(copy.deepcopy(rows))
+
+            if query._action == "insert":
+                inserted = []
+                for row in query._payload:
+                    row = self._resolve(row)
+                    row.setdefault("id", str(next(self._ids)))
+                    self.rows[row["id"]] = row
+                    inserted.append(row)
+                return LocalResponse(copy.deepcopy(inserted))
+
+            if query._action == "upsert":
+                upserted = []
+                for row in query._payload:
+                    key = row[query._on_conflict]
+                    existing = self.rows.setdefault(key, {})
+                    existing.update(self._resolve(row))
+                    upserted.append(existing)
+                return LocalResponse(copy.deepcopy(upserted))
+
+            if query._action == "update":
+                updated = self._selected(query)
+                for row in updated:
+                    row.update(self._resolve(query._payload))
+                return LocalResponse(copy.deepcopy(updated))
+
+            if query._action == "delete":
+                deleted = self._selected(query)
+                for row in deleted:
+                    del self.rows[row["id"]]
+                return LocalResponse(copy.deepcopy(deleted))
+
+            raise ValueError(f"Unsupported action: {query._action}")
+
+class LocalRpcCall:
+    """Deferred database function call; runs on execute() like the postgrest builder."""
+
+    def __init__(self, function, params: Dict[str, Any], latency: float = 0.0, error_rate: float = 0.0):
+        self._function = function
+        self._params = params
+        self._latency = latency
+        self._error_rate = error_rate
+
+    def execute(self) -> LocalResponse:
+        _simulate_request(self._latency, self._error_rate, "database")
+        return LocalResponse(self._function(**self._params))
+
+class LocalSupabaseClient:
+    """Stand-in for supabase.Client backed by in-memory tables."""
+
+    def __init__(self, latency: float = 0.0, error_rate: float = 0.0):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.tables: Dict[str, LocalTable] = {}
+        self.rpc_count = 0
+        self._lock = threading.Lock()
+        self._functions = {
+            "claim_candidates": self._claim_candidates,
+            "claim_assets": self._claim_assets,
+            "renew_leases": self._renew_leases,
+            "complete_assets": self._complete_assets
+        }
+
+    def table(self, name: str) -> LocalTableQuery:
+        with self._lock:
+            if name not in self.tables:
+                self.tables[name] = LocalTable(name, self.latency, self.error_rate)
+            return LocalTableQuery(self.tables[name])
+
+    def rpc(self, name: str, params: Dict[str, Any]) -> LocalRpcCall:
+        with self._lock:
+            self.rpc_count += 1
+        return LocalRpcCall(self._functions[name], params, self.latency, self.error_rate)
+
+    def _claim_candidates(self, per_tenant: int, n: int) -> List[Dict[str, Any]]:
+        """Mirror of the claim_candidates database function."""
+        table = self.table("assets")._table
+        with table._lock:
+            table.request_count += 1
+            now = _utc_now()
+            rows = sorted(table.rows.values(), key=lambda row: row.get("created_at") or "")
+            tenant_ranks: Dict[Any, int] = {}
+            ranked = []
+            for row in rows:
+                expired = row.get("lease_expires_at") is not None and row["lease_expires_at"] < now
+                if row.get("status") != "processing" or not (row.get("claimed_by") is None or expired):
+                    continue
+                tenant = row.get("organization_id") or row.get("user_id")
+                tenant_ranks[tenant] = tenant_ranks.get(tenant, 0) + 1
+                if tenant_ranks[tenant] <= per_tenant:
+                    ranked.append((tenant_ranks[tenant], row))
+            ranked.sort(key=lambda entry: entry[0])
+            return [copy.deepcopy(row) for _, row in ranked[:n]]
+
+    def _claim_assets(self, worker: str, n: int, lease_seconds: int,
+                      candidates: Optional[List[Any]] = None) -> List[Dict[str, Any]]:
+        """Mirror of the claim_assets database function."""
+        table = self.table("assets")._table
+        claimed = []
+        with table._lock:
+            table.request_count += 1
+            now = _utc_now()
+            if candidates is None:
+                rows = sorted(table.rows.values(), key=lambda row: row.get("created_at") or "")
+            else:
+                rows = [table.rows[asset_id] for asset_id in candidates if asset_id in table.rows]
+            
+            for row in rows:
+                if len(claimed) >= n:
+                    break
+                expired = row.get("lease_expires_at") is not None and row["lease_expires_at"] < now
+                if row.get("status") == "processing" and (row.get("claimed_by") is None or expired):
+                    row["claimed_by"] = worker
+                    row["lease_expires_at"] = _utc_now(lease_seconds)
+                    claimed.append(copy.deepcopy(row))
+        return claimed
+
+    def _renew_leases(self, worker: str, ids: List[Any], lease_seconds: int) -> List[Any]:
+        """Mirror of the renew_leases database function."""
+        table = self.table("assets")._table
+        renewed = []
+        with table._lock:
+            table.request_count += 1
+            for asset_id in ids:
+                row = table.rows.get(asset_id)
+                if row is not None and row.get("claimed_by") == worker:
+                    row["lease_expires_at"] = _utc_now(lease_seconds)
+                    renewed.append(asset_id)
+        return renewed
+
+    def _complete_assets(self, updates: List[Dict[str, Any]], worker: str) -> List[Any]:
+        """Mirror of the complete_assets database function."""
+        table = self.table("assets")._table
+        written = []
+        with table._lock:
+            table.request_count += 1
+            for update in updates:
+                row = table.rows.get(update["id"])
+                if row is None or row.get("claimed_by") != worker:
+                    continue
+                row["status"] = update["status"]
+                if update.get("output_url"):
+                    row["output_url"] = update["output_url"]
+                    row["completed_at"] = _utc_now()
+                if update.get("retry_in") is not None:
+                    row["attempts"] = (row.get("attempts") or 0) + 1
+                    row["lease_expires_at"] = _utc_now(update["retry_in"])
+                else:
+                    row["claimed_by"] = None
+                    row["lease_expires_at"] = None
+                written.append(row["id"])
+        return written
+
+class LocalOpenAIServer:
+    """HTTP stand-in for the OpenAI chat completions endpoint.
+    
+    Responds after `latency` seconds, enforces its own requests-per-minute
+    quota and additionally rejects `error_rate` of requests, answering
+    rejected requests with a 429 and a Retry-After header like the real API.
+    """
+
+    def __init__(self, latency: float = 0.0, error_rate: float = 0.0, requests_per_minute: Optional[int] = None,
+                 retry_after: Optional[float] = 1.0, port: int = 0):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.requests_per_minute = requests_per_minute
+        self.retry_after = retry_after
+        self.requests = 0
+        self.rate_limited = 0
+        self.concurrent = 0
+        self.max_concurrent = 0
+        self._recent: deque = deque()
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(("127.0.0.1", port), self._handler())
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, name="local-openai", daemon=True)
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/v1/"
+
+    def start(self) -> "LocalOpenAIServer":
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+    def _admit(self) -> bool:
+        with self._lock:
+            self.requests += 1
+            now = time.time()
+            while self._recent and self._recent[0] < now - 60:
+                self._recent.popleft()
+            
+            over_quota = self.requests_per_minute is not None and len(self._recent) >= self.requests_per_minute
+            if over_quota or random.random() < self.error_rate:
+                self.rate_limited += 1
+                return False
+            
+            self._recent.append(now)
+            self.concurrent += 1
+            self.max_concurrent = max(self.max_concurrent, self.concurrent)
+            return True
+
+    def _completion(self, request: Dict[str, Any]) -> Dict[str, Any]:
+        prompt = " ".join(message.get("content", "") for message in request.get("messages", []))
+        content = f"Local completion for a {len(prompt)}-character prompt."
+        prompt_tokens = len(prompt) // 4
+        completion_tokens = len(content) // 4
+        return {
+            "id": f"chatcmpl-local-{self.requests}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": request.get("model", "local"),
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+            "usage": {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens
+            }
+        }
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                pass
+
+            def _send(self, status: int, body: Dict[str, Any], headers: Optional[Dict[str, str]] = None) -> None:
+                payload = json.dumps(body).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length", 0))
+                request = json.loads(self.rfile.read(length) or b"{}")
+                
+                if not self.path.rstrip("/").endswith("/chat/completions"):
+                    self._send(404, {"error": {"message": f"Unknown path {self.path}"}})
+                    return
+                
+                if not server._admit():
+                    headers = {"Retry-After": str(server.retry_after)} if server.retry_after is not None else {}
+                    self._send(429, {"error": {"message": "Rate limit reached", "type": "requests"}}, headers)
+                    return
+                
+                try:
+                    time.sleep(server.latency)
+                    self._send(200, server._completion(request))
+                finally:
+                    with server._lock:
+                        server.concurrent -= 1
+
+        return Handler
+
+class LocalDirectoryStorage:
+    """Directory-backed stand-in for the S3-compatible output storage.
+    
+    Objects are files under `root`; multipart uploads keep their parts under
+    `root/.uploads` until completed. Every request takes `latency` seconds and
+    `error_rate` of part uploads fail, to exercise retries and resumption.
+    """
+
+    def __init__(self, root: str, latency: float = 0.0, error_rate: float = 0.0):
+        self.root = os.path.abspath(root)
+        self.latency = latency
+        self.error_rate = error_rate
+        self.requests = 0
+        self.parts_uploaded = 0
+        self._lock = threading.Lock()
+        os.makedirs(os.path.join(self.root, ".uploads"), exist_ok=True)
+
+    def _object_path(self, path: str) -> str:
+        return os.path.join(self.root, path)
+
+    def _upload_dir(self, upload_id: str) -> str:
+        upload_dir = os.path.join(self.root, ".uploads", upload_id)
+        if not os.path.isdir(upload_dir):
+            raise KeyError(f"NoSuchUpload: {upload_id}")
+        return upload_dir
+
+    def _count(self) -> None:
+        with self._lock:
+            self.requests += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def _write(self, path: str, chunks: List[bytes]) -> None:
+        target = self._object_path(path)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        temp_path = f"{target}.{uuid.uuid4().hex}.tmp"
+        with open(temp_path, "wb") as f:
+            for chunk in chunks:
+                f.write(chunk)
+        os.replace(temp_path, target)
+
+    def exists(self, path: str) -> bool:
+        self._count()
+        return os.path.exists(self._object_path(path))
+
+    def put_object(self, path: str, data: bytes, content_type: str) -> None:
+        self._count()
+        self._write(path, [data])
+
+    def create_multipart_upload(self, path: str, content_type: str) -> str:
+        self._count()
+        upload_id = uuid.uuid4().hex
+        os.makedirs(os.path.join(self.root, ".uploads", upload_id))
+        return upload_id
+
+    def upload_part(self, path: str, upload_id: str, part_number: int, data: bytes) -> str:
+        self._count()
+        if random.random() < self.error_rate:
+            raise ConnectionError(f"Simulated failure uploading part {part_number}")
+        
+        with open(os.path.join(self._upload_dir(upload_id), str(part_number)), "wb") as f:
+            f.write(data)
+        with self._lock:
+            self.parts_uploaded += 1
+        return f"etag-{part_number}-{len(data)}"
+
+    def list_parts(self, path: str, upload_id: str) -> Dict[int, str]:
+        self._count()
+        upload_dir = self._upload_dir(upload_id)
+        return {
+            int(name): f"etag-{name}-{os.path.getsize(os.path.join(upload_dir, name))}"
+            for name in os.listdir(upload_dir)
+        }
+
+    def complete_multipart_upload(self, path: str, upload_id: str, parts: List[Tuple[int, str]]) -> None:
+        self._count()
+        upload_dir = self._upload_dir(upload_id)
+        target = self._object_path(path)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        temp_path = f"{target}.{upload_id}.tmp"
+        with open(temp_path, "wb") as output:
+            for part_number, _ in parts:
+                with open(os.path.join(upload_dir, str(part_number)), "rb") as part:
+                    output.write(part.read())
+        os.replace(temp_path, target)
+        self.abort_multipart_upload(path, upload_id)
+
+    def abort_multipart_upload(self, path: str, upload_id: str) -> None:
+        upload_dir = os.path.join(self.root, ".uploads", upload_id)
+        for name in os.listdir(upload_dir):
+            os.remove(os.path.join(upload_dir, name))
+        os.rmdir(upload_dir)
+
+    def public_url(self, path: str) -> str:
+        return f"file://{self._object_path(path)}"
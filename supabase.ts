@@ -21,6 +21,7 @@ export type Organization = {
   name: string;
   created_at: string;
   subscription_status: 'active' | 'inactive' | 'trial';
+  credit_tier?: 'starter' | 'professional' | 'enterprise';
 };
 
 export type CreditPackage = {
@@ -59,6 +60,9 @@ export type Asset = {
   audience?: string;
   tone?: string;
   compliance_text?: string;
+  claimed_by?: string;
+  lease_expires_at?: string;
+  attempts?: number;
 };
 
 // SQL for creating tables in Supabase
@@ -78,10 +82,17 @@ export const createTableSQL = {
       id UUID PRIMARY KEY DEFAULT uuid_generate_v4(),
       name TEXT NOT NULL,
       created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
-      subscription_status TEXT DEFAULT 'trial'
+      subscription_status TEXT DEFAULT 'trial',
+      credit_tier TEXT DEFAULT 'starter'
     );
   `,
   
+  // Credit tier used by the document workers to weight each organization's
+  // share of processing capacity
+  organizations_credit_tier: `
+    ALTER TABLE organizations ADD COLUMN IF NOT EXISTS credit_tier TEXT DEFAULT 'starter';
+  `,
+  
   credit_packages: `
     CREATE TABLE IF NOT EXISTS credit_packages (
       id UUID PRIMARY KEY DEFAULT uuid_generate_v4(),
@@ -122,7 +133,119 @@ export const createTableSQL = {
       credits_used INTEGER DEFAULT 0,
       audience TEXT,
       tone TEXT,
-      compliance_text TEXT
+      compliance_text TEXT,
+      claimed_by TEXT,
+      lease_expires_at TIMESTAMP WITH TIME ZONE,
+      attempts INTEGER DEFAULT 0
     );
+  `,
+  
+  // Columns added to assets for job claiming and retries. CREATE TABLE IF NOT
+  // EXISTS leaves existing tables alone, so databases created before these
+  // columns existed are migrated here
+  assets_claiming: `
+    ALTER TABLE assets ADD COLUMN IF NOT EXISTS claimed_by TEXT;
+    ALTER TABLE assets ADD COLUMN IF NOT EXISTS lease_expires_at TIMESTAMP WITH TIME ZONE;
+    ALTER TABLE assets ADD COLUMN IF NOT EXISTS attempts INTEGER DEFAULT 0;
+    CREATE INDEX IF NOT EXISTS assets_claim_idx
+      ON assets (status, claimed_by, lease_expires_at, created_at);
+    CREATE INDEX IF NOT EXISTS assets_tenant_queue_idx
+      ON assets (organization_id, user_id, created_at) WHERE status = 'processing';
+  `,
+  
+  // Candidate window for the scheduler: the oldest per_tenant claimable assets
+  // of every tenant (organization, or user without one), at most n in total.
+  // Every tenant's oldest asset comes before any tenant's second, so a tenant
+  // with a large backlog never pushes the others out of the window
+  claim_candidates: `
+    CREATE OR REPLACE FUNCTION claim_candidates(per_tenant INTEGER, n INTEGER)
+    RETURNS SETOF assets AS $$
+      SELECT a.*
+      FROM assets AS a
+      JOIN (
+        SELECT id, row_number() OVER (
+          PARTITION BY COALESCE(organization_id, user_id) ORDER BY created_at
+        ) AS tenant_rank
+        FROM assets
+        WHERE status = 'processing'
+          AND (claimed_by IS NULL OR lease_expires_at < NOW())
+      ) AS q ON q.id = a.id
+      WHERE q.tenant_rank <= per_tenant
+      ORDER BY q.tenant_rank, a.created_at
+      LIMIT n;
+    $$ LANGUAGE sql STABLE;
+  `,
+  
+  // Claims up to n claimable assets for a worker in one statement: pending
+  // assets that are unclaimed or whose lease has expired, taken in the order of
+  // `candidates` when given and oldest first otherwise. Rows another worker is
+  // claiming at the same moment are skipped rather than waited on, and leases
+  // are computed with the database clock
+  claim_assets: `
+    CREATE OR REPLACE FUNCTION claim_assets(worker TEXT, n INTEGER, lease_seconds INTEGER, candidates UUID[] DEFAULT NULL)
+    RETURNS SETOF assets AS $$
+      UPDATE assets AS a
+      SET claimed_by = worker,
+          lease_expires_at = NOW() + lease_seconds * INTERVAL '1 second'
+      WHERE a.id IN (
+        SELECT id FROM assets
+        WHERE status = 'processing'
+          AND (claimed_by IS NULL OR lease_expires_at < NOW())
+          AND (candidates IS NULL OR id = ANY(candidates))
+        ORDER BY array_position(candidates, id), created_at
+        LIMIT n
+        FOR UPDATE SKIP LOCKED
+      )
+      RETURNING a.*;
+    $$ LANGUAGE sql;
+  `,
+  
+  // Extends the leases a worker still holds; returns the IDs that were renewed
+  renew_leases: `
+    CREATE OR REPLACE FUNCTION renew_leases(worker TEXT, ids UUID[], lease_seconds INTEGER)
+    RETURNS SETOF UUID AS $$
+      UPDATE assets
+      SET lease_expires_at = NOW() + lease_seconds * INTERVAL '1 second'
+      WHERE id = ANY(ids) AND claimed_by = worker
+      RETURNING id;
+    $$ LANGUAGE sql;
+  `,
+  
+  // Bulk status commit used by the document workers. Only rows still claimed by
+  // the calling worker are updated; returns the IDs that were written. An update
+  // with retry_in re-queues the asset: the worker's lease is kept until the
+  // retry is due, after which any worker can claim it again
+  complete_assets: `
+    CREATE OR REPLACE FUNCTION complete_assets(updates JSONB, worker TEXT)
+    RETURNS SETOF UUID AS $$
+      UPDATE assets AS a
+      SET status = u.status,
+          output_url = COALESCE(u.output_url, a.output_url),
+          completed_at = CASE WHEN u.output_url IS NOT NULL THEN NOW() ELSE a.completed_at END,
+          attempts = a.attempts + CASE WHEN u.retry_in IS NOT NULL THEN 1 ELSE 0 END,
+          claimed_by = CASE WHEN u.retry_in IS NOT NULL THEN a.claimed_by ELSE NULL END,
+          lease_expires_at = CASE WHEN u.retry_in IS NOT NULL THEN NOW() + u.retry_in * INTERVAL '1 second' ELSE NULL END
+      FROM jsonb_to_recordset(updates) AS u(id UUID, status TEXT, output_url TEXT, retry_in DOUBLE PRECISION)
+      WHERE a.id = u.id AND a.claimed_by = worker
+      RETURNING a.id;
+    $$ LANGUAGE sql;
+  `,
+  
+  // Wakes document workers listening on the assets_pending channel as soon as
+  // an asset is queued for processing
+  assets_pending_notify: `
+    CREATE OR REPLACE FUNCTION notify_asset_pending() RETURNS trigger AS $$
+    BEGIN
+      IF NEW.status = 'processing' THEN
+        PERFORM pg_notify('assets_pending', NEW.id::text);
+      END IF;
+      RETURN NEW;
+    END;
+    $$ LANGUAGE plpgsql;
+    
+    DROP TRIGGER IF EXISTS assets_pending_notify ON assets;
+    CREATE TRIGGER assets_pending_notify
+      AFTER INSERT OR UPDATE OF status ON assets
+      FOR EACH ROW EXECUTE FUNCTION notify_asset_pending();
   `
 };
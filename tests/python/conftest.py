@@ -0,0 +1,54 @@
+import os
+import sys
+import tempfile
+
+import pytest
+
+# The worker reads its configuration at import time, so point every on-disk
+# cache and journal at a scratch directory before any test imports it
+SCRATCH_DIR = tempfile.mkdtemp(prefix="tome-tests-")
+for name in ("CHECKPOINT_DIR", "EXTRACTION_CACHE_DIR", "COMPLETION_CACHE_DIR", "SECTION_INDEX_DIR",
+             "UPLOAD_JOURNAL_DIR", "PROFILE_DIR"):
+    os.environ[name] = os.path.join(SCRATCH_DIR, name.lower())
+os.environ["OPENAI_RATE_LIMIT_STATE"] = os.path.join(SCRATCH_DIR, "openai-limiter.json")
+os.environ["OUTPUT_STORAGE"] = f"local:{os.path.join(SCRATCH_DIR, 'outputs')}"
+os.environ["SIMULATE_PROCESSING"] = "true"
+os.environ["SIMULATED_WORK_SCALE"] = "0"
+os.environ.pop("DATABASE_URL", None)
+os.environ.pop("METRICS_PORT", None)
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
+
+import document_processor
+from local_backends import LocalSupabaseClient
+
+@pytest.fixture
+def database(monkeypatch):
+    """A fresh in-memory Supabase stand-in installed as the worker's client."""
+    client = LocalSupabaseClient()
+    monkeypatch.setattr(document_processor, "supabase", client)
+    return client
+
+@pytest.fixture
+def insert_assets(database):
+    """Queue `count` pending assets, oldest first, and return their rows."""
+    def insert(count, **fields):
+        rows = [
+            {
+                "id": f"asset-{index}",
+                "asset_type": "job-aid",
+                "organization_id": "org-1",
+                "user_id": "user-1",
+                "original_document_url": "https://example.com/document.pdf",
+                "original_document_name": "document.pdf",
+                "status": "processing",
+                "attempts": 0,
+                "created_at": document_processor.utc_timestamp(index - count),
+                **fields
+            }
+            for index in range(count)
+        ]
+        database.table("assets").insert(rows).execute()
+        return rows
+    
+    return insert
@@ -0,0 +1,28 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import document_processor
+from document_processor import checkpoint_store, process_document_group, status_sink
+
+def test_failed_unknown_type_asset_leaves_no_checkpoint(database, insert_assets, monkeypatch):
+    extract_document = document_processor.extract_document
+    
+    def extract_after_commit(url):
+        # The sink commits the failed asset's status while the document is extracted
+        status_sink.flush()
+        return extract_document(url)
+    
+    monkeypatch.setattr(document_processor, "extract_document", extract_after_commit)
+    assets = insert_assets(2, claimed_by=document_processor.WORKER_ID)
+    assets[1]["asset_type"] = "bogus"
+    database.table("assets").update({"asset_type": "bogus"}).eq("id", "asset-1").execute()
+    
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        process_document_group(assets, executor)
+    status_sink.flush()
+    
+    rows = {row["id"]: row for row in database.table("assets").select("*").execute().data}
+    assert rows["asset-0"]["status"] == "completed"
+    assert rows["asset-1"]["status"] == "failed"
+    assert not os.path.exists(os.path.join(checkpoint_store.directory, "asset-0"))
+    assert not os.path.exists(os.path.join(checkpoint_store.directory, "asset-1"))
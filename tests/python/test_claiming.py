@@ -0,0 +1,102 @@
+import threading
+
+from document_processor import (AssetScheduler, CostModel, CreditTiers, StatusSink, claim_assets,
+                                claim_scheduled_assets, fetch_claim_candidates, renew_leases, utc_timestamp)
+
+def claim_all(worker_id, limit=100, lease_seconds=300):
+    return claim_assets(fetch_claim_candidates(limit), limit, worker_id, lease_seconds)
+
+def test_competing_workers_claim_each_asset_once(database, insert_assets):
+    insert_assets(40)
+    candidates = fetch_claim_candidates(100)
+    results = {}
+    start = threading.Barrier(4)
+    
+    def worker(worker_id):
+        start.wait()
+        # Every worker races for the same candidate window, a few assets at a time
+        claimed = []
+        while True:
+            batch = claim_assets(candidates, 3, worker_id)
+            if not batch:
+                break
+            claimed += batch
+        results[worker_id] = [asset["id"] for asset in claimed]
+    
+    threads = [threading.Thread(target=worker, args=(f"worker-{index}",)) for index in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    
+    claimed_ids = [asset_id for ids in results.values() for asset_id in ids]
+    assert sorted(claimed_ids) == sorted(asset["id"] for asset in candidates)
+    rows = database.table("assets").select("id,claimed_by").execute().data
+    owners = {asset_id: worker_id for worker_id, ids in results.items() for asset_id in ids}
+    assert all(row["claimed_by"] == owners[row["id"]] for row in rows)
+
+def test_claim_is_one_request_and_keeps_candidate_order(database, insert_assets):
+    insert_assets(5)
+    candidates = list(reversed(fetch_claim_candidates(10)))
+    rpc_count = database.rpc_count
+    
+    claimed = claim_assets(candidates, 3, "worker-a")
+    
+    assert [asset["id"] for asset in claimed] == [asset["id"] for asset in candidates[:3]]
+    assert database.rpc_count == rpc_count + 1
+
+def test_expired_lease_is_reclaimed(database, insert_assets):
+    insert_assets(2)
+    assert len(claim_all("worker-a", lease_seconds=-1)) == 2
+    
+    reclaimed = claim_all("worker-b")
+    
+    assert sorted(asset["id"] for asset in reclaimed) == ["asset-0", "asset-1"]
+    assert renew_leases(["asset-0", "asset-1"], "worker-a") == []
+
+def test_live_lease_is_not_reclaimed(database, insert_assets):
+    insert_assets(2)
+    claim_all("worker-a")
+    
+    assert claim_all("worker-b") == []
+    assert sorted(renew_leases(["asset-0", "asset-1"], "worker-a")) == ["asset-0", "asset-1"]
+
+def test_complete_assets_rejects_worker_without_lease(database, insert_assets):
+    insert_assets(1)
+    claim_all("worker-a", lease_seconds=-1)
+    claim_all("worker-b")
+    sink = StatusSink()
+    
+    sink.record("asset-0", "completed", "https://example.com/a.html", worker_id="worker-a")
+    sink.flush()
+    row = database.table("assets").select("*").execute().data[0]
+    assert row["status"] == "processing"
+    assert row["claimed_by"] == "worker-b"
+    
+    sink.record("asset-0", "completed", "https://example.com/b.html", worker_id="worker-b")
+    sink.flush()
+    row = database.table("assets").select("*").execute().data[0]
+    assert row["status"] == "completed"
+    assert row["output_url"] == "https://example.com/b.html"
+    assert row["claimed_by"] is None
+
+def test_small_tenant_is_not_starved_by_a_large_backlog(database):
+    database.table("organizations").insert([
+        {"id": "org-big", "credit_tier": "enterprise"},
+        {"id": "org-small", "credit_tier": "starter"}
+    ]).execute()
+    backlog = [
+        {"id": f"video-{index}", "asset_type": "video", "organization_id": "org-big", "user_id": "user-big",
+         "status": "processing", "created_at": utc_timestamp(index - 1000)}
+        for index in range(800)
+    ]
+    job_aid = {"id": "job-aid", "asset_type": "job-aid", "organization_id": "org-small", "user_id": "user-small",
+               "status": "processing", "created_at": utc_timestamp()}
+    database.table("assets").insert(backlog + [job_aid]).execute()
+    scheduler = AssetScheduler(cost_model=CostModel(), tiers=CreditTiers())
+    
+    claimed = []
+    while len(claimed) < 100:
+        claimed += [asset["id"] for asset in claim_scheduled_assets(scheduler, 10)]
+    
+    assert claimed.index("job-aid") < 10
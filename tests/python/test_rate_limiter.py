@@ -0,0 +1,98 @@
+import json
+import time
+import urllib.error
+import urllib.request
+
+import pytest
+
+from document_processor import OpenAIRateLimiter, RateLimitedError
+from local_backends import LocalOpenAIServer
+
+class RateLimitError(Exception):
+    """Shaped like the openai client's errors: a status code and the HTTP response."""
+
+    def __init__(self, status_code, headers):
+        super().__init__(f"HTTP {status_code}")
+        self.status_code = status_code
+        self.response = type("Response", (), {"headers": headers})()
+
+def post_completion(server):
+    request = urllib.request.Request(
+        server.base_url + "chat/completions",
+        data=json.dumps({"model": "local", "messages": [{"role": "user", "content": "Hello"}]}).encode("utf-8"),
+        headers={"Content-Type": "application/json"}
+    )
+    try:
+        with urllib.request.urlopen(request) as response:
+            return json.load(response)
+    except urllib.error.HTTPError as e:
+        raise RateLimitError(e.code, {name.lower(): value for name, value in e.headers.items()}) from None
+
+@pytest.fixture
+def server():
+    server = LocalOpenAIServer().start()
+    yield server
+    server.stop()
+
+def test_rate_limit_halves_concurrency_limit():
+    limiter = OpenAIRateLimiter(max_concurrency=16, state_path=None)
+    
+    for expected in (8, 4, 2, 1, 1):
+        limiter.acquire(100)
+        limiter.release(rate_limited=True, estimated_tokens=100)
+        assert limiter.concurrency_limit() == expected
+
+def test_successes_grow_limit_additively():
+    limiter = OpenAIRateLimiter(max_concurrency=16, state_path=None)
+    limiter.acquire(100)
+    limiter.release(rate_limited=True, estimated_tokens=100)
+    
+    for _ in range(9):
+        limiter.acquire(100)
+        limiter.release(estimated_tokens=100)
+    
+    # About one more slot per limit's worth of successes, never a doubling
+    assert limiter.concurrency_limit() == 9
+
+def test_call_honours_retry_after(server):
+    limiter = OpenAIRateLimiter(max_concurrency=8, state_path=None)
+    server.retry_after = 0.3
+    server.error_rate = 1.0
+    attempts = []
+    
+    def call():
+        attempts.append(time.monotonic())
+        try:
+            return post_completion(server)
+        finally:
+            # Only the first request is rejected
+            server.error_rate = 0.0
+    
+    result = limiter.call(call, 100)
+    
+    assert result["choices"][0]["message"]["content"].startswith("Local completion")
+    assert server.rate_limited == 1
+    # The retry waits out Retry-After instead of the exponential backoff
+    assert 0.3 <= attempts[1] - attempts[0] < 0.5
+    assert limiter.concurrency_limit() == 4
+
+def test_call_gives_up_after_max_retries(server):
+    limiter = OpenAIRateLimiter(max_concurrency=8, state_path=None)
+    server.retry_after = 0.01
+    server.error_rate = 1.0
+    
+    with pytest.raises(RateLimitedError):
+        limiter.call(lambda: post_completion(server), 100, max_retries=2)
+    assert server.rate_limited == 3
+
+def test_truncated_state_file_is_reset(tmp_path):
+    state_path = tmp_path / "limiter.json"
+    state_path.write_text('{"requests": 499.0, "tok')
+    limiter = OpenAIRateLimiter(requests_per_minute=500, state_path=str(state_path))
+    
+    limiter.acquire(10)
+    limiter.release(estimated_tokens=10, used_tokens=10)
+    
+    state = json.loads(state_path.read_text())
+    assert state["in_flight"] == {}
+    assert 498 <= state["requests"] <= 500
@@ -0,0 +1,27 @@
+import os
+
+from document_processor import SectionIndex
+
+SECTIONS = {"1 Purpose": {"fingerprint": "f" * 64, "fragment": "<section>Purpose</section>" * 10}}
+
+def test_least_recently_used_lineage_is_evicted(tmp_path):
+    directory = str(tmp_path / "index")
+    probe = SectionIndex(directory)
+    probe.save("probe", SECTIONS)
+    entry_bytes = os.path.getsize(os.path.join(directory, "probe.json"))
+    os.remove(os.path.join(directory, "probe.json"))
+    
+    index = SectionIndex(directory, max_bytes=2 * entry_bytes)
+    index.save("first", SECTIONS)
+    index.save("second", SECTIONS)
+    os.utime(os.path.join(directory, "first.json"), (1, 1))
+    os.utime(os.path.join(directory, "second.json"), (2, 2))
+    
+    # Reading a lineage makes it recently used again
+    assert index.load("first") == SECTIONS
+    index.save("third", SECTIONS)
+    
+    assert index.load("second") == {}
+    assert index.load("first") == SECTIONS
+    assert index.load("third") == SECTIONS
+    assert index.evictions == 1
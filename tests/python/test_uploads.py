@@ -0,0 +1,95 @@
+import os
+import threading
+
+import pytest
+
+from document_processor import OutputUploader
+from local_backends import LocalDirectoryStorage
+
+CONTENT = b"".join(f"line {index}\n".encode("utf-8") for index in range(1000))
+
+class FlakyStorage(LocalDirectoryStorage):
+    """Local storage whose upload of given part numbers fails once each."""
+
+    def __init__(self, root, failing_parts=()):
+        super().__init__(root)
+        self.failing_parts = set(failing_parts)
+        self.uploaded_parts = []
+
+    def upload_part(self, path, upload_id, part_number, data):
+        if part_number in self.failing_parts:
+            self.failing_parts.discard(part_number)
+            raise ConnectionError(f"Simulated failure uploading part {part_number}")
+        etag = super().upload_part(path, upload_id, part_number, data)
+        self.uploaded_parts.append(part_number)
+        return etag
+
+@pytest.fixture
+def journal_dir(tmp_path):
+    return str(tmp_path / "journal")
+
+def read_object(storage, path):
+    with open(os.path.join(storage.root, path), "rb") as f:
+        return f.read()
+
+def test_multipart_upload_resumes_after_failed_part(tmp_path, journal_dir):
+    storage = FlakyStorage(str(tmp_path / "outputs"), failing_parts={3})
+    uploader = OutputUploader(storage, part_bytes=1024, max_retries=0, journal_dir=journal_dir)
+    part_count = (len(CONTENT) + 1023) // 1024
+    
+    with pytest.raises(ConnectionError):
+        uploader.upload(CONTENT, ".txt", "text/plain")
+    assert sorted(storage.uploaded_parts) == [part for part in range(1, part_count + 1) if part != 3]
+    assert len(os.listdir(journal_dir)) == 1
+    
+    storage.uploaded_parts.clear()
+    path = uploader.upload(CONTENT, ".txt", "text/plain")
+    
+    # Only the failed part is sent again
+    assert storage.uploaded_parts == [3]
+    assert read_object(storage, path) == CONTENT
+    assert os.listdir(journal_dir) == []
+
+def test_failed_part_is_retried_within_upload(tmp_path, journal_dir):
+    storage = FlakyStorage(str(tmp_path / "outputs"), failing_parts={2})
+    uploader = OutputUploader(storage, part_bytes=1024, max_retries=2, journal_dir=journal_dir)
+    
+    path = uploader.upload(iter([CONTENT[:3000], CONTENT[3000:]]), ".txt", "text/plain")
+    
+    assert storage.uploaded_parts.count(2) == 1
+    assert read_object(storage, path) == CONTENT
+
+def test_identical_output_is_uploaded_once(tmp_path, journal_dir):
+    storage = FlakyStorage(str(tmp_path / "outputs"))
+    uploader = OutputUploader(storage, part_bytes=1024, max_retries=0, journal_dir=journal_dir)
+    
+    first = uploader.upload(CONTENT, ".txt", "text/plain")
+    parts_uploaded = storage.parts_uploaded
+    second = uploader.upload(CONTENT.decode("utf-8"), ".txt", "text/plain")
+    
+    assert first == second
+    assert uploader.deduplicated == 1
+    assert storage.parts_uploaded == parts_uploaded
+
+def test_concurrent_identical_uploads_share_one_upload(tmp_path, journal_dir):
+    storage = FlakyStorage(str(tmp_path / "outputs"))
+    uploader = OutputUploader(storage, part_bytes=1024, max_retries=0, journal_dir=journal_dir)
+    content = CONTENT * 2
+    start = threading.Barrier(2)
+    paths = []
+    
+    def upload():
+        start.wait()
+        paths.append(uploader.upload(content, ".txt", "text/plain"))
+    
+    threads = [threading.Thread(target=upload) for _ in range(2)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    
+    assert len(paths) == 2 and paths[0] == paths[1]
+    assert uploader.deduplicated == 1
+    assert sorted(storage.uploaded_parts) == list(range(1, (len(content) + 1023) // 1024 + 1))
+    assert read_object(storage, paths[0]) == content
+    assert os.listdir(journal_dir) == []